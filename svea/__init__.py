@@ -1 +1,6 @@
-from .controller import SveaController
\ No newline at end of file
+def __getattr__(name):
+    # The controller needs ctdpy, ctdvis etc. Imported on first use so that the other modules can be used without them.
+    if name == 'SveaController':
+        from .controller import SveaController
+        return SveaController
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,243 @@
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import uuid
+from pathlib import Path
+
+from svea import exceptions
+
+LINK_MODES = ['reflink', 'hardlink', 'symlink', 'copy']
+# Placed files that can be edited in place get their own inode (reflinks are copy on write)
+EDITABLE_LINK_MODES = ['reflink', 'copy']
+
+FICLONE = 0x40049409  # linux/fs.h
+
+
+class ArtifactStore:
+    """
+    Content addressed file store. Files are stored once under <root>/objects/<hash[:2]>/<hash> and placed in the
+    stage directories (raw_files, cnv, standard_format...) as reflinks, hardlinks or symlinks to the stored object.
+    Objects in the store are read only. Files placed with editable=True are reflinks to the stored object if the
+    filesystem supports reflinks, otherwise plain copies that are not added to the store (the content would be stored
+    twice). Use unprotect(path) before editing a file that was placed as a hardlink or symlink.
+    """
+    def __init__(self, root_directory, link_modes=None, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.root_directory = Path(root_directory).absolute()
+        self.objects_directory = Path(self.root_directory, 'objects')
+        self.temp_directory = Path(self.root_directory, 'tmp')
+        self.link_modes = link_modes or LINK_MODES[:]
+        for mode in self.link_modes:
+            if mode not in LINK_MODES:
+                raise exceptions.SveaException(f'Invalid link mode "{mode}". Valid modes are: {LINK_MODES}')
+        self._hash_cache = {}
+        # Set to False when a reflink has failed, editable files are then copied without the store
+        self._reflink_available = 'reflink' in self.link_modes
+        for directory in [self.objects_directory, self.temp_directory]:
+            if not directory.exists():
+                os.makedirs(directory)
+
+    def __repr__(self):
+        return f'ArtifactStore({self.root_directory})'
+
+    def get_hash(self, file_path):
+        """
+        Returns the sha256 hex digest of the file. Digests are cached on path, size and modification time.
+        :param file_path:
+        :return:
+        """
+        file_path = Path(file_path)
+        st = file_path.stat()
+        key = (str(file_path.resolve()), st.st_size, st.st_mtime_ns)
+        digest = self._hash_cache.get(key)
+        if digest:
+            return digest
+        h = hashlib.sha256()
+        with open(file_path, 'rb') as fid:
+            for chunk in iter(lambda: fid.read(1024 * 1024), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._hash_cache[key] = digest
+        return digest
+
+    def get_object_path(self, digest):
+        return Path(self.objects_directory, digest[:2], digest)
+
+    def add(self, file_path, reflink=False):
+        """
+        Adds the file to the store (if not already present) and returns the hash.
+        :param file_path:
+        :param reflink: Add the file as a reflink. Raises OSError if reflinks are not supported.
+        :return:
+        """
+        file_path = Path(file_path)
+        digest = self.get_hash(file_path)
+        object_path = self.get_object_path(digest)
+        if object_path.exists():
+            return digest
+        if not object_path.parent.exists():
+            os.makedirs(object_path.parent, exist_ok=True)
+        temp_path = Path(self.temp_directory, uuid.uuid4().hex)
+        if reflink:
+            try:
+                self._reflink(file_path, temp_path)
+            except OSError:
+                if temp_path.exists():
+                    os.remove(temp_path)
+                raise
+        else:
+            shutil.copyfile(file_path, temp_path)
+        os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(temp_path, object_path)
+        self.logger.debug(f'Added {file_path.name} to artifact store as {digest}')
+        return digest
+
+    def is_placed(self, object_path, target_path):
+        """ Returns True if target_path already refers to object_path. """
+        if not target_path.exists():
+            return False
+        if target_path.is_symlink():
+            return Path(os.readlink(target_path)) == object_path
+        try:
+            return os.path.samefile(object_path, target_path)
+        except OSError:
+            return False
+
+    def place(self, source_path, target_path, overwrite=True, editable=False):
+        """
+        Places the content of source_path at target_path through the store.
+        Returns the hash of the content or None if the file was not placed due to overwrite=False.
+        :param source_path:
+        :param target_path:
+        :param overwrite:
+        :param editable: target_path gets its own writable inode, for directories where files are edited in place by
+                         other tools. Reflinked through the store if possible, otherwise copied without the store.
+        :return:
+        """
+        source_path = Path(source_path)
+        target_path = Path(target_path)
+        if target_path.exists() and not overwrite:
+            return None
+        if editable:
+            return self._place_editable(source_path, target_path)
+        digest = self.add(source_path)
+        object_path = self.get_object_path(digest)
+        if self.is_placed(object_path, target_path):
+            return digest
+        elif target_path.exists() and not target_path.is_symlink() and self.get_hash(target_path) == digest:
+            return digest
+        self._link(object_path, target_path, self.link_modes)
+        return digest
+
+    def _place_editable(self, source_path, target_path):
+        digest = None
+        if self._reflink_available:
+            try:
+                digest = self.add(source_path, reflink=True)
+            except OSError:
+                self._reflink_available = False
+                self.logger.info('Reflinks are not supported by the artifact store, editable files are copied')
+        if digest is None:
+            # No copy on write: a copy in the store would only double the disk usage
+            digest = self.get_hash(source_path)
+            if not self._is_private_copy(target_path, digest):
+                self._link(source_path, target_path, ['copy'])
+            return digest
+        if not self._is_private_copy(target_path, digest):
+            self._link(self.get_object_path(digest), target_path, EDITABLE_LINK_MODES)
+        return digest
+
+    def _is_private_copy(self, target_path, digest):
+        """ Returns True if target_path is a writable file of its own (not a hardlink or symlink) with the content. """
+        if not target_path.exists() or is_shared(target_path):
+            return False
+        return self.get_hash(target_path) == digest
+
+    def _link(self, source_path, target_path, link_modes):
+        """ Links to a temporary name next to the target and replaces the target. Existing files are never written to. """
+        if not target_path.parent.exists():
+            os.makedirs(target_path.parent)
+        temp_path = Path(target_path.parent, f'.{target_path.name}.{uuid.uuid4().hex}')
+        for mode in link_modes:
+            try:
+                getattr(self, f'_{mode}')(source_path, temp_path)
+                break
+            except OSError:
+                if temp_path.exists() or temp_path.is_symlink():
+                    os.remove(temp_path)
+                continue
+        else:
+            raise exceptions.PathError(f'Could not place file {target_path} using any of the link modes {link_modes}')
+        os.replace(temp_path, target_path)
+
+    @staticmethod
+    def unprotect(target_path):
+        """
+        Replaces a placed file with a private writable copy so that it can be edited without changing the store.
+        :param target_path:
+        :return:
+        """
+        unprotect_file(target_path)
+
+    @staticmethod
+    def _reflink(source_path, target_path):
+        import fcntl
+        with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+    @staticmethod
+    def _hardlink(source_path, target_path):
+        os.link(source_path, target_path)
+
+    @staticmethod
+    def _symlink(source_path, target_path):
+        os.symlink(source_path, target_path)
+
+    @staticmethod
+    def _copy(source_path, target_path):
+        shutil.copyfile(source_path, target_path)
+
+
+def is_shared(file_path):
+    """ Returns True if file_path is a symlink, a hardlink or read only, i.e. may be an object in an artifact store. """
+    file_path = Path(file_path)
+    if file_path.is_symlink():
+        return True
+    st = file_path.stat()
+    return st.st_nlink > 1 or not st.st_mode & stat.S_IWUSR
+
+
+def unprotect_file(file_path):
+    """
+    Replaces the file with a private writable copy if it is shared (see is_shared). Returns True if replaced.
+    """
+    file_path = Path(file_path)
+    if not is_shared(file_path):
+        return False
+    temp_path = Path(file_path.parent, f'.{file_path.name}.{uuid.uuid4().hex}')
+    shutil.copyfile(file_path, temp_path)
+    os.chmod(temp_path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(temp_path, file_path)
+    return True
+
+
+def unprotect_directory(directory, pattern='*'):
+    """
+    Unprotects the shared files in directory before they are handed to tools that edit files in place.
+    :return: list of unprotected files
+    """
+    return [path for path in sorted(Path(directory).glob(pattern)) if path.is_file() and unprotect_file(path)]
+
+
+def place_file(source_path, target_path, artifact_store=None, editable=False):
+    """ Copies the file or places it via the artifact store if given. See ArtifactStore.place for editable. """
+    if artifact_store:
+        artifact_store.place(source_path, target_path, editable=editable)
+        return
+    target_path = Path(target_path)
+    if target_path.is_symlink() or (target_path.exists() and target_path.stat().st_nlink > 1):
+        # Do not write through a link into the artifact store
+        os.remove(target_path)
+    shutil.copyfile(source_path, target_path)
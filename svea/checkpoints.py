@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+
+class Checkpoints:
+    """
+    Keeps track of completed stages and completed units (casts) within a stage. Progress is saved in one json file
+    per stage in the given directory (normally <working directory>/checkpoints). Files are written atomically so
+    that a process that dies halfway never leaves a broken checkpoint file behind.
+    The names of the files created by a unit can be saved with the unit so that a unit whose output has been
+    removed is processed again.
+    """
+    def __init__(self, directory, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.directory = Path(directory)
+        self._stages = {}
+
+    def __repr__(self):
+        return f'Checkpoints({self.directory})'
+
+    def _get_file_path(self, stage):
+        return Path(self.directory, f'{stage}.json')
+
+    def _get_stage(self, stage):
+        if stage not in self._stages:
+            data = {'completed': False, 'units': {}, 'outputs': {}}
+            file_path = self._get_file_path(stage)
+            if file_path.exists():
+                try:
+                    with open(file_path) as fid:
+                        data.update(json.load(fid))
+                except ValueError:
+                    self.logger.warning(f'Could not read checkpoint file {file_path}. Starting stage {stage} from scratch.')
+            self._stages[stage] = data
+        return self._stages[stage]
+
+    def _save_stage(self, stage):
+        if not self.directory.exists():
+            os.makedirs(self.directory)
+        file_path = self._get_file_path(stage)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=f'.{stage}.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fid:
+                json.dump(self._stages[stage], fid, indent=2)
+                fid.flush()
+                os.fsync(fid.fileno())
+            os.replace(temp_path, file_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def is_done(self, stage, key, signature=None, directory=None):
+        """
+        Returns True if the unit is completed. If signature is given it has to match the signature saved when the
+        unit was completed (i.e. the input has not changed since).
+        :param stage:
+        :param key:
+        :param signature:
+        :param directory: If given, the output files saved with the unit have to exist in directory. Units saved
+                          without output files are then not considered done.
+        :return:
+        """
+        data = self._get_stage(stage)
+        units = data['units']
+        if key not in units:
+            return False
+        if signature is not None and units[key] != signature:
+            return False
+        if directory is None:
+            return True
+        outputs = data['outputs'].get(key)
+        if not outputs:
+            return False
+        return all(Path(directory, name).exists() for name in outputs)
+
+    def mark_done(self, stage, key, signature=None, outputs=None):
+        """
+        :param outputs: names of the files created by the unit, see is_done
+        """
+        self.mark_many_done(stage, {key: (signature, outputs)})
+
+    def mark_many_done(self, stage, units):
+        """
+        Marks several units as done with one write of the checkpoint file.
+        :param units: dict like {key: (signature, outputs)}
+        """
+        data = self._get_stage(stage)
+        for key, (signature, outputs) in units.items():
+            data['units'][key] = signature
+            if outputs is not None:
+                data['outputs'][key] = list(outputs)
+        self._save_stage(stage)
+
+    def get_done(self, stage):
+        return list(self._get_stage(stage)['units'])
+
+    def is_stage_done(self, stage):
+        return self._get_stage(stage)['completed']
+
+    def mark_stage_done(self, stage, done=True):
+        self._get_stage(stage)['completed'] = done
+        self._save_stage(stage)
+
+    def reset(self, stage=None):
+        """
+        Removes checkpoints for the given stage or for all stages if stage is None.
+        :param stage:
+        :return:
+        """
+        if stage is None:
+            stages = [path.stem for path in self.directory.glob('*.json')] if self.directory.exists() else []
+            stages = set(stages + list(self._stages))
+        else:
+            stages = [stage]
+        for st in stages:
+            self._stages.pop(st, None)
+            file_path = self._get_file_path(st)
+            if file_path.exists():
+                os.remove(file_path)
+
+
+def get_file_signature(file_path):
+    """ Cheap signature of a file used to detect changed input. """
+    st = Path(file_path).stat()
+    return f'{st.st_size}_{st.st_mtime_ns}'
@@ -0,0 +1,130 @@
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import time
+from pathlib import Path
+
+
+def read_files(reader, file_names, progress=None):
+    """
+    Reads files with a ctdpy reader the same way as ctdpy Session.read() does. With progress the files are read one
+    at a time and progress is updated per file.
+    """
+    if not progress:
+        return reader.get_data(filenames=file_names, add_low_resolution_data=False)
+    data = {}
+    for file_name in file_names:
+        progress.check()
+        data.update(reader.get_data(filenames=[file_name], add_low_resolution_data=False))
+        progress.update(os.path.basename(file_name))
+    return data
+
+
+def read_session(session, progress=None):
+    """ Same as session.read() (ctdpy) but progress is updated per file. """
+    return [read_files(reader_info['reader'], reader_info['file_names'], progress=progress)
+            for reader_info in session.readers.values()]
+
+
+class CNVParseCache:
+    """
+    Cache of parsed cnv files shared by the stages that read cnv files with ctdpy (metadata file and standard format
+    creation). Parsed files are kept in memory and, if persist is True, pickled to <directory>/<hash>.pkl so that
+    unchanged files are not parsed again in later runs. Files are identified by the sha256 of their content.
+
+    Use read(session) instead of session.read(). Items are copied when handed out since the stages modify them.
+    """
+    def __init__(self, directory=None, persist=False, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.directory = Path(directory) if directory else None
+        self.persist = bool(persist and directory)
+        self._items = {}
+        self._hashes = {}
+
+    def __repr__(self):
+        return f'CNVParseCache({self.directory}, persist={self.persist}, nr_files={len(self._items)})'
+
+    def clear(self):
+        self._items = {}
+        self._hashes = {}
+
+    def get_hash(self, file_path, reader_name=''):
+        st = os.stat(file_path)
+        key = (str(Path(file_path).resolve()), st.st_size, st.st_mtime_ns, reader_name)
+        if key not in self._hashes:
+            h = hashlib.sha256(reader_name.encode())
+            with open(file_path, 'rb') as fid:
+                for chunk in iter(lambda: fid.read(1024 * 1024), b''):
+                    h.update(chunk)
+            self._hashes[key] = h.hexdigest()
+        return self._hashes[key]
+
+    def read(self, session, progress=None):
+        """
+        Same as session.read() (ctdpy) but cnv files are taken from the cache when possible.
+        :param session: ctdpy session created with filepaths and reader
+        :param progress: svea.progress.Progress, updated per file
+        :return: datasets
+        """
+        datasets = []
+        for dataset, reader_info in session.readers.items():
+            file_names = reader_info['file_names']
+            reader = reader_info['reader']
+            if not all(str(file_name).lower().endswith('.cnv') for file_name in file_names):
+                datasets.append(read_files(reader, file_names, progress=progress))
+                continue
+            datasets.append(self._get_data(reader, dataset, file_names, progress=progress))
+        return datasets
+
+    def _get_data(self, reader, dataset, file_names, progress=None):
+        start_time = time.time()
+        nr_parsed = 0
+        out = {}
+        for file_name in file_names:
+            if progress:
+                progress.check()
+            file_hash = self.get_hash(file_name, reader_name=dataset)
+            if not self._load(file_hash):
+                data = read_files(reader, [file_name])
+                nr_parsed += 1
+                fid = os.path.basename(file_name)
+                if fid in data:
+                    self._add(file_hash, fid, data[fid])
+            fid, item = self._items.get(file_hash, (None, None))
+            if fid is not None:
+                out[os.path.basename(file_name)] = copy.deepcopy(item)
+            if progress:
+                progress.update(os.path.basename(file_name))
+        self.logger.debug(f'{nr_parsed} cnv files parsed in {time.time() - start_time} seconds')
+        self.logger.debug(f'{len(file_names) - nr_parsed} of {len(file_names)} cnv files taken from cache')
+        return out
+
+    def _add(self, file_hash, fid, item):
+        self._items[file_hash] = (fid, copy.deepcopy(item))
+        if not self.persist:
+            return
+        if not self.directory.exists():
+            os.makedirs(self.directory)
+        file_path = Path(self.directory, f'{file_hash}.pkl')
+        temp_path = Path(self.directory, f'.{file_hash}.{os.getpid()}.tmp')
+        with open(temp_path, 'wb') as fid_out:
+            pickle.dump((fid, item), fid_out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, file_path)
+
+    def _load(self, file_hash):
+        if file_hash in self._items:
+            return True
+        if not self.persist:
+            return False
+        file_path = Path(self.directory, f'{file_hash}.pkl')
+        if not file_path.exists():
+            return False
+        try:
+            with open(file_path, 'rb') as fid:
+                self._items[file_hash] = pickle.load(fid)
+        except Exception as e:
+            self.logger.warning(f'Could not load cached cnv file {file_path}: {e}')
+            return False
+        return True
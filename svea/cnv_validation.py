@@ -0,0 +1,147 @@
+"""
+Quick validation of cnv files before they are parsed by ctdpy.
+
+Each file is read once as bytes. The header is checked line by line and the data block is checked with a few
+calls on the whole block:
+    - header lines start with * or #
+    - the header ends with *END*
+    - required header keys are present (nquan, nvalues and one "name <i>" per column)
+    - number of data lines equals nvalues
+    - number of values equals nquan * nvalues and the first and last data lines have nquan columns
+"""
+import concurrent.futures
+import os
+import re
+import shutil
+from pathlib import Path
+
+from svea import executors
+
+END_MARKER = b'*END*'
+REQUIRED_KEYS = ['nquan', 'nvalues']
+
+ON_INVALID = ['raise', 'reject', 'quarantine']
+
+_KEY_PATTERN = re.compile(r'^#\s*([^=]+?)\s*=\s*(.*)$')
+
+
+def get_header_info(header_lines):
+    """ Returns the "# key = value" lines of the header as a dict. """
+    info = {}
+    for line in header_lines:
+        match = _KEY_PATTERN.match(line)
+        if match:
+            info[match.group(1)] = match.group(2).strip()
+    return info
+
+
+def validate_cnv_file(file_path, required_keys=None):
+    """
+    Module level function so that it can be run by any executor.
+    :param file_path:
+    :param required_keys: header keys in addition to REQUIRED_KEYS
+    :return: list of errors. Empty list if the file is valid.
+    """
+    required_keys = REQUIRED_KEYS + [key for key in (required_keys or []) if key not in REQUIRED_KEYS]
+    try:
+        with open(file_path, 'rb') as fid:
+            content = fid.read()
+    except OSError as e:
+        return [f'Could not read file: {e}']
+    if not content.strip():
+        return ['Empty file']
+    if not content.startswith(b'*'):
+        return ['File does not start with a header line (*)']
+
+    end_index = content.find(END_MARKER)
+    if end_index == -1:
+        return ['Missing *END* marker']
+
+    errors = []
+    header_lines = content[:end_index].decode('latin-1').splitlines()
+    for nr, line in enumerate(header_lines, 1):
+        if line.strip() and not line.startswith(('*', '#')):
+            errors.append(f'Invalid header line {nr}: {line[:40]}')
+            break
+
+    info = get_header_info(header_lines)
+    missing = [key for key in required_keys if key not in info]
+    if missing:
+        errors.append(f'Missing header keys: {missing}')
+        return errors
+
+    try:
+        nquan = int(info['nquan'])
+        nvalues = int(info['nvalues'])
+    except ValueError:
+        errors.append(f'Invalid nquan ({info["nquan"]}) or nvalues ({info["nvalues"]})')
+        return errors
+
+    missing_names = [f'name {i}' for i in range(nquan) if f'name {i}' not in info]
+    if missing_names:
+        errors.append(f'Missing header keys: {missing_names}')
+
+    data_start = content.find(b'\n', end_index)
+    data = content[data_start + 1:] if data_start != -1 else b''
+    data_lines = data.split(b'\n')
+    while data_lines and not data_lines[-1].strip():
+        data_lines.pop()
+    if len(data_lines) != nvalues:
+        errors.append(f'Number of scans ({len(data_lines)}) does not match nvalues ({nvalues})')
+    if data_lines:
+        for nr in sorted({0, len(data_lines) - 1}):
+            nr_columns = len(data_lines[nr].split())
+            if nr_columns != nquan:
+                errors.append(f'Data line {nr + 1} has {nr_columns} columns, expected {nquan} (nquan)')
+        nr_values = len(data.split())
+        if nr_values != nquan * len(data_lines):
+            errors.append(f'Number of values ({nr_values}) does not match nquan ({nquan}) * number of scans '
+                          f'({len(data_lines)})')
+    return errors
+
+
+def validate_cnv_files(file_paths, executor=None, max_workers=None, required_keys=None, progress=None):
+    """
+    Validates files in parallel. Uses executor if given (see svea.executors), else a thread pool.
+    :return: dict like {file_path: list of errors} for invalid files only
+    """
+    units = {path: (validate_cnv_file, (str(path), ), dict(required_keys=required_keys)) for path in file_paths}
+    own_executor = None
+    if executor is None:
+        own_executor = executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    invalid = {}
+    try:
+        for path, future in executors.iter_completed(executor, units, progress=progress):
+            try:
+                errors = future.result()
+            except Exception as e:
+                errors = [f'Validation failed: {e}']
+            if errors:
+                invalid[path] = errors
+    finally:
+        if own_executor:
+            own_executor.shutdown()
+    return invalid
+
+
+def quarantine_files(invalid, directory):
+    """
+    Copies invalid files to directory and writes the errors to <file name>.errors.txt next to each file. The original
+    files are left where they are.
+    :param invalid: dict like {file_path: list of errors}
+    :param directory:
+    :return: list of new paths
+    """
+    directory = Path(directory)
+    if not directory.exists():
+        os.makedirs(directory)
+    new_paths = []
+    for path, errors in invalid.items():
+        path = Path(path)
+        target_path = Path(directory, path.name)
+        if path.exists():
+            shutil.copy2(str(path), str(target_path))
+        with open(Path(directory, f'{path.name}.errors.txt'), 'w') as fid:
+            fid.write('\n'.join(errors) + '\n')
+        new_paths.append(target_path)
+    return new_paths
@@ -0,0 +1,150 @@
+"""
+Compact in memory representation of datasets (as returned by ctdpy session.read()).
+
+    float64 columns        -> float32 if all values can be recovered with their number of decimals
+    numbers stored as text -> float32 (or float64) if the text can be recovered, i.e. all values have the same
+                              number of decimals and no other formatting (missing values as empty strings)
+    integer columns        -> smallest integer type
+    qc flag columns        -> categorical (small integer codes)
+    other text columns     -> categorical if few unique values, e.g. metadata repeated on every row
+
+ctdpy reads the data as text, so most data columns are numbers stored as text.
+Datasets are compacted after they have been written, the written files are not affected. This lowers the memory
+held by datasets kept after a stage. The peak is not lowered: the ctdpy writer joins the values as text and the qc
+needs the original dtypes, so the datasets can not be compacted before they are written.
+"""
+import gc
+import logging
+
+import numpy as np
+import pandas as pd
+
+from svea.stdfmt_reader import is_qc_column
+
+MAX_DECIMALS = 6
+CATEGORY_RATIO = 0.5
+
+
+def iter_frames(obj):
+    """ Yields (container, key, frame) for all pandas objects in nested dicts and lists. """
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, list):
+        items = enumerate(obj)
+    else:
+        return
+    for key, value in items:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            yield obj, key, value
+        else:
+            yield from iter_frames(value)
+
+
+def get_memory_usage(datasets):
+    """ Returns the memory used by all DataFrames and Series in datasets (bytes). """
+    total = 0
+    for _, _, frame in iter_frames(datasets):
+        usage = frame.memory_usage(deep=True)
+        total += int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    return total
+
+
+def can_be_float32(values, max_decimals=MAX_DECIMALS):
+    finite = values[np.isfinite(values)]
+    if not finite.size:
+        return True
+    as_float32 = finite.astype(np.float32).astype(np.float64)
+    for decimals in range(max_decimals + 1):
+        if np.array_equal(np.round(finite, decimals), finite):
+            return np.array_equal(np.round(as_float32, decimals), finite)
+    return False
+
+
+def get_numbers_from_text(serie, max_decimals=MAX_DECIMALS):
+    """
+    Returns a text column as float64 if all values are numbers written with the same number of decimals, so that the
+    text can be recovered with '%.<decimals>f'. Missing values and empty strings become NaN. Otherwise returns None.
+    """
+    if not len(serie) or pd.api.types.infer_dtype(serie, skipna=True) != 'string':
+        return None
+    text = serie.fillna('')
+    present = (text != '').to_numpy()
+    if not present.any():
+        return None
+    text = text[present]
+    values = pd.to_numeric(text, errors='coerce')
+    if values.isna().any():
+        return None
+    # Values with another number of decimals than the first value differ when formatted
+    decimals = len(text.iloc[0].partition('.')[2])
+    if decimals > max_decimals:
+        return None
+    formatted = np.char.mod(f'%.{decimals}f', values.to_numpy(dtype=np.float64))
+    if not np.array_equal(formatted, text.to_numpy(dtype=str)):
+        return None
+    numbers = np.full(len(serie), np.nan)
+    numbers[present] = values.to_numpy(dtype=np.float64)
+    return pd.Series(numbers, index=serie.index, name=serie.name)
+
+
+def compact_series(serie, name=None, max_decimals=MAX_DECIMALS, category_ratio=CATEGORY_RATIO):
+    name = str(serie.name if name is None else name)
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie
+    if is_qc_column(name):
+        return serie.astype('category')
+    if pd.api.types.is_float_dtype(serie.dtype):
+        if serie.dtype == np.float64 and can_be_float32(serie.to_numpy(), max_decimals=max_decimals):
+            return serie.astype(np.float32)
+        return serie
+    if pd.api.types.is_integer_dtype(serie.dtype):
+        return pd.to_numeric(serie, downcast='integer')
+    if pd.api.types.is_object_dtype(serie.dtype) or pd.api.types.is_string_dtype(serie.dtype):
+        numbers = get_numbers_from_text(serie, max_decimals=max_decimals)
+        if numbers is not None:
+            return compact_series(numbers, name=name, max_decimals=max_decimals, category_ratio=category_ratio)
+        if len(serie) and serie.nunique(dropna=False) <= category_ratio * len(serie):
+            return serie.astype('category')
+    return serie
+
+
+def compact_frame(frame, max_decimals=MAX_DECIMALS, category_ratio=CATEGORY_RATIO):
+    if isinstance(frame, pd.Series):
+        return compact_series(frame, max_decimals=max_decimals, category_ratio=category_ratio)
+    frame = frame.copy(deep=False)
+    for i, name in enumerate(frame.columns):
+        frame.isetitem(i, compact_series(frame.iloc[:, i], name=name, max_decimals=max_decimals,
+                                         category_ratio=category_ratio))
+    return frame
+
+
+def compact_datasets(datasets, max_decimals=MAX_DECIMALS, category_ratio=CATEGORY_RATIO, logger=None, name=''):
+    """
+    Compacts all DataFrames and Series in datasets in place and logs the memory usage before and after.
+    :return: dict like {'before': bytes, 'after': bytes}
+    """
+    logger = logger or logging.getLogger(__name__)
+    before = get_memory_usage(datasets)
+    for container, key, frame in list(iter_frames(datasets)):
+        container[key] = compact_frame(frame, max_decimals=max_decimals, category_ratio=category_ratio)
+    after = get_memory_usage(datasets)
+    logger.info(f'Memory used by datasets {name}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB')
+    return {'before': before, 'after': after}
+
+
+def release_datasets(datasets):
+    """ Empties the dicts and lists in datasets so that the data can be garbage collected. """
+    _clear(datasets)
+    gc.collect()
+
+
+def _clear(obj):
+    if isinstance(obj, dict):
+        values = list(obj.values())
+    elif isinstance(obj, list):
+        values = obj[:]
+    else:
+        return
+    obj.clear()
+    for value in values:
+        _clear(value)
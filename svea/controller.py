@@ -1,10 +1,18 @@
+import asyncio
 import codecs
+import concurrent.futures
+import functools
 import shutil
+import socket
+import threading
+import http.client
 import time
 from pathlib import Path
 import os
 import sys
 import openpyxl
+import numpy as np
+import pandas as pd
 
 import subprocess
 import webbrowser
@@ -18,6 +26,22 @@ from ctdvis  import session as ctdvis_session
 from ctd_processing.former_processing import CtdProcessing
 
 from svea import exceptions
+from svea.artifact_store import ArtifactStore, place_file, unprotect_directory
+from svea.checkpoints import Checkpoints, get_file_signature
+from svea import metadata_workbook
+from svea.metadata_workbook import MetadataWorkbook
+from svea import executors
+from svea.progress import CancellationToken, Progress
+from svea.profiling import StageProfiler
+from svea import cnv_cache
+from svea.cnv_cache import CNVParseCache
+from svea import cnv_validation
+from svea import compact
+from svea import downsampling as downsampling_module
+from svea import flag_deltas
+from svea.profile_index import ProfileIndex
+from svea import stdfmt_reader
+from svea import stdfmt_writer
 
 import logging
 import logging.config
@@ -25,6 +49,24 @@ import logging.handlers
 
 SHARK_PACKAGES = ['sharkpylib', 'ctdpy', 'ctdvis']
 
+CHECKPOINT_STANDARD_FORMAT = 'create_standard_format'
+CHECKPOINT_AUTOMATIC_QC = 'perform_automatic_qc'
+
+BACKGROUND_STAGES = ['sbe_processing', 'create_metadata_file', 'create_standard_format', 'perform_automatic_qc']
+
+VISUAL_QC_DEFAULT_SESSION = 'default'
+
+
+def profiled_stage(method):
+    """ Profiles the stage method if profiling is enabled on the controller. """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._profiler:
+            return method(self, *args, **kwargs)
+        with self._profiler.profile(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class SveaSteps:
     def __init__(self):
@@ -37,6 +79,23 @@ class SveaSteps:
         self.import_to_lims = False
         self.create_station_plots = False
 
+        self.checkpoints = None
+
+    @property
+    def steps(self):
+        return [key for key in self.__dict__ if key != 'checkpoints']
+
+    def set_checkpoints(self, checkpoints):
+        """ Sets the checkpoints object and loads the status of all steps from it. """
+        self.checkpoints = checkpoints
+        for step in self.steps:
+            setattr(self, step, bool(checkpoints and checkpoints.is_stage_done(step)))
+
+    def mark_done(self, step):
+        setattr(self, step, True)
+        if self.checkpoints:
+            self.checkpoints.mark_stage_done(step)
+
 
 class CommonFiles:
     def change_location(self, directory):
@@ -67,7 +126,7 @@ class CommonFiles:
                 continue
             if file_path == new_file_path:
                 continue
-            shutil.copyfile(file_path, new_file_path)
+            place_file(file_path, new_file_path, artifact_store=self.artifact_store, editable=self.editable_files)
         self._file_paths = file_paths
 
 
@@ -93,6 +152,8 @@ class SveaController:
         self._steps = SveaSteps()
 
         self._ctd_processing_object = CtdProcessing(logger=self.logger)
+        # Options set on _ctd_processing_object. Also passed to the work units in sbe_processing
+        self._ctd_processing_settings = {}
 
         self._raw_files_object = RawFiles(logger=logger)
 
@@ -119,7 +180,36 @@ class SveaController:
         self._automatic_qc_object = AutomaticQC(logger=self.logger)
         self._automatic_qc_object.standard_files_object = self._standard_files_object
 
-        self._visual_qc_object = VisualQC(logger=self.logger)
+        self._visual_qc_sessions = {}
+
+        self._executor = None
+        self._background_executor = None
+        self._progress = Progress(logger=self.logger)
+        self._profiler = None
+
+        # Pass profiles in memory from create_standard_format to perform_automatic_qc
+        self.in_memory_handoff = False
+
+        # Resume from saved progress, see set_checkpoints
+        self._checkpoints_enabled = False
+
+        # Share parsed cnv files between stages, see set_cnv_cache
+        self._cnv_cache_enabled = False
+        self._cnv_cache_persist = False
+
+        # svea.stdfmt_writer patches the ctdpy writer, see set_fast_writer
+        self._fast_writer = False
+        self._fast_reader = True
+
+        self._compact_datasets = False
+        self._release_datasets = False
+
+        # Validation of cnv files before create_metadata_file and create_standard_format, see set_cnv_validation
+        self._cnv_validation = None
+        self._cnv_required_keys = None
+
+        # Index of standard format files shared by several working directories, see enable_profile_index
+        self._profile_index = None
 
         self.logger.info('SveaController instance created!')
         
@@ -158,6 +248,11 @@ class SveaController:
             self.dirs['standard_files'] = Path(self.dirs['working'], 'standard_format')
             self.dirs['standard_files_qc'] = Path(self.dirs['working'], 'standard_format_auto_qc')
 
+        self._set_checkpoints()
+        self._set_cnv_cache()
+        temp_directory = Path(self.dirs['working'], 'temp') if self.dirs['working'] else None
+        self._create_standard_files_object.temp_directory = temp_directory
+        self._automatic_qc_object.temp_directory = temp_directory
         self._metadata_file_object.file_path = self.dirs['cnv_files']
         self._create_standard_files_object.directory = self.dirs['standard_files']
         self._standard_files_object.file_paths = self.dirs['standard_files']
@@ -167,6 +262,149 @@ class SveaController:
     def set_path_working_directory(self, directory):
         self.working_directory = directory
 
+    def set_checkpoints(self, enabled=True):
+        """
+        With checkpoints, progress is saved in <working directory>/checkpoints so that a new SveaController pointed
+        at the same working directory resumes from the last completed cast. Casts are then written one by one.
+        Casts whose input is unchanged and whose output files still exist are skipped.
+        :param enabled:
+        :return:
+        """
+        self._checkpoints_enabled = enabled
+        self._set_checkpoints()
+
+    def _set_checkpoints(self):
+        checkpoints = None
+        if self._checkpoints_enabled and self.dirs['working']:
+            checkpoints = Checkpoints(Path(self.dirs['working'], 'checkpoints'), logger=self.logger)
+        self._steps.set_checkpoints(checkpoints)
+        self._create_standard_files_object.checkpoints = checkpoints
+        self._automatic_qc_object.checkpoints = checkpoints
+
+    def set_cnv_cache(self, enabled=True, persist=False):
+        """
+        Parsed cnv files are shared between create_metadata_file and create_standard_format so that each file is
+        parsed once per run. The parsed files are kept in memory until create_standard_format is done. With
+        persist=True parsed files are also saved in <working directory>/cache/cnv and reused as long as the cnv files
+        are unchanged.
+        :param enabled:
+        :param persist:
+        :return:
+        """
+        self._cnv_cache_enabled = enabled
+        self._cnv_cache_persist = persist
+        self._set_cnv_cache()
+
+    def _set_cnv_cache(self):
+        cache = None
+        if self._cnv_cache_enabled:
+            directory = Path(self.dirs['working'], 'cache', 'cnv') if self.dirs['working'] else None
+            cache = CNVParseCache(directory, persist=self._cnv_cache_persist, logger=self.logger)
+        self._create_metadata_file_object.cnv_cache = cache
+        self._create_standard_files_object.cnv_cache = cache
+
+    @property
+    def fast_writer(self):
+        return self._fast_writer
+
+    def set_fast_writer(self, fast=True):
+        """
+        With fast=True standard format files are written with svea.stdfmt_writer. The output is the same as from the
+        ctdpy writer but private methods of the ctdpy writer instance are replaced, so the fast writer needs to be
+        checked (see svea.stdfmt_writer.compare_with_ctdpy_writer) when ctdpy is updated. Default is the ctdpy writer
+        as is.
+        :param fast:
+        :return:
+        """
+        self._fast_writer = fast
+        self._create_standard_files_object.fast_writer = fast
+        self._automatic_qc_object.fast_writer = fast
+
+    @property
+    def fast_reader(self):
+        return self._fast_reader
+
+    def set_fast_reader(self, fast=True):
+        """
+        Standard format files are read with svea.stdfmt_reader in perform_automatic_qc by default. Set fast=False to
+        use the ctdpy reader.
+        :param fast:
+        :return:
+        """
+        self._fast_reader = fast
+        self._automatic_qc_object.fast_reader = fast
+
+    def set_compact_datasets(self, compact=True, release=False):
+        """
+        Options for the datasets kept by create_standard_format and perform_automatic_qc after the files are written.
+        Datasets are compacted after the write since the writer and the qc need the original dtypes, so compacting
+        lowers the memory held after the stage, not the peak during it. Memory usage before and after is logged and
+        available in dataset_memory_usage.
+        :param compact: Keep the datasets with compact dtypes, see svea.compact
+        :param release: Release the datasets when the stage has written its files. Datasets are then not compacted.
+        :return:
+        """
+        self._compact_datasets = compact
+        self._release_datasets = release
+        for obj in [self._create_standard_files_object, self._automatic_qc_object]:
+            obj.compact_datasets = compact
+            obj.release_datasets = release
+
+    def set_cnv_validation(self, on_invalid='raise', required_keys=None):
+        """
+        Turns on validation of the cnv files before create_metadata_file and create_standard_format so that bad files
+        are found before any parsing starts. Validation is off by default.
+        :param on_invalid: 'raise', 'reject', 'quarantine' (invalid files are copied to <working directory>/quarantine/cnv)
+                           or None to skip validation. See CNVfiles.validate.
+        :param required_keys: header keys required in addition to nquan and nvalues, e.g. ['start_time', 'bad_flag']
+        :return:
+        """
+        if on_invalid and on_invalid not in cnv_validation.ON_INVALID:
+            raise exceptions.SveaException(f'Invalid option on_invalid="{on_invalid}". Valid options are: {cnv_validation.ON_INVALID}')
+        self._cnv_validation = on_invalid
+        self._cnv_required_keys = required_keys
+
+    def validate_cnv_files(self, on_invalid=None):
+        """
+        Validates the selected cnv files. Uses the option from set_cnv_validation if on_invalid is not given.
+        :return: dict like {file_path: list of errors} for invalid files
+        """
+        on_invalid = on_invalid or self._cnv_validation or 'raise'
+        quarantine_directory = None
+        if on_invalid == 'quarantine':
+            self._assert_directory()
+            quarantine_directory = Path(self.dirs['working'], 'quarantine', 'cnv')
+        return self._cnv_files_object.validate(on_invalid=on_invalid,
+                                               quarantine_directory=quarantine_directory,
+                                               executor=self.executor,
+                                               required_keys=self._cnv_required_keys)
+
+    def _validate_cnv_files_before_stage(self):
+        if not self._cnv_validation or not self._cnv_files_object.file_paths:
+            return
+        self.validate_cnv_files()
+
+    @property
+    def dataset_memory_usage(self):
+        """ Memory usage (bytes) of the datasets from the last run of each stage. """
+        return {CHECKPOINT_STANDARD_FORMAT: self._create_standard_files_object.memory_usage,
+                CHECKPOINT_AUTOMATIC_QC: self._automatic_qc_object.memory_usage}
+
+    def reset_checkpoints(self, stage=None):
+        """
+        Removes saved progress so that the stage (or all stages if stage is None) is processed from scratch.
+        :param stage: e.g. 'create_standard_format' or 'perform_automatic_qc'
+        :return:
+        """
+        if not self._steps.checkpoints:
+            return
+        self._steps.checkpoints.reset(stage)
+        self._steps.set_checkpoints(self._steps.checkpoints)
+
+    @property
+    def steps(self):
+        return {step: getattr(self._steps, step) for step in self._steps.steps}
+
     @property
     def metadata_file_path(self):
         return self._metadata_file_object.file_path
@@ -175,46 +413,226 @@ class SveaController:
     def ctd_processing_options(self):
         return self._ctd_processing_object.options
 
+    @profiled_stage
     def sbe_processing(self, file_path, **kwargs):
         """
         kwargs are options that you can get from self.ctd_processing_options
+        :param file_path: One file or a list of files. Lists are processed file by file using the executor.
         :param kwargs:
         :return:
         """
-        for key, value in kwargs.items():
-            setattr(self._ctd_processing_object, key, value)
-        print('FILE PATH', file_path)
-        self._ctd_processing_object.load_seabird_files(file_path)
-        self._ctd_processing_object.run_process()
+        if isinstance(file_path, (list, tuple)):
+            self._sbe_processing_files(file_path, **kwargs)
+        else:
+            self._progress.start('sbe_processing', 1)
+            self._set_ctd_processing_options(**kwargs)
+            print('FILE PATH', file_path)
+            self._ctd_processing_object.load_seabird_files(file_path)
+            self._ctd_processing_object.run_process()
+            self._progress.update(Path(file_path).name)
 
         self._assert_directory() 
         # if not self._raw_files_object.file_paths:
         #     raise exceptions.PathError('No raw files selected')
         # self._raw_files_object.change_location(self.dirs['raw_files'])
-        self._steps.sbe_processing = True
+        self._steps.mark_done('sbe_processing')
         # return self.dirs['raw_files']
 
+    def _set_ctd_processing_options(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self._ctd_processing_object, key, value)
+        self._ctd_processing_settings.update(kwargs)
+
+    def _sbe_processing_files(self, file_paths, **kwargs):
+        # Same options as on _ctd_processing_object for the single file case
+        self._set_ctd_processing_options(**kwargs)
+        options = dict(self._ctd_processing_settings)
+        self._progress.start('sbe_processing', len(file_paths))
+        units = {str(path): (sbe_process_file, (str(path), ), options) for path in file_paths}
+        if self._profiler:
+            units = self._profiler.wrap_units('sbe_processing', units, self.executor)
+        failed = []
+        for path, future in executors.iter_completed(self.executor, units, progress=self._progress):
+            if future.exception():
+                self.logger.error(f'SBE processing failed for {path}: {future.exception()}')
+                failed.append(path)
+            self._progress.update(Path(path).name)
+        if failed:
+            raise exceptions.SveaException(f'SBE processing failed for files: {failed}')
+
+    @property
+    def executor(self):
+        return self._executor
+
+    def set_executor(self, executor=None, max_workers=None, **kwargs):
+        """
+        Sets the executor used for the per cast work units in sbe_processing, create_standard_format and
+        perform_automatic_qc.
+        :param executor: 'serial', 'thread', 'process', 'tcp', an executor instance or None (no executor)
+        :param max_workers: for thread and process pools
+        :param kwargs: for the tcp executor: address=(host, port), authkey=..., allow_remote=True to accept workers
+                       on other machines (default is localhost only)
+        :return: the executor. For tcp, workers connect to executor.address using executor.authkey
+        """
+        self.close_executor()
+        if isinstance(executor, str):
+            if executor == 'tcp':
+                kwargs.setdefault('logger', self.logger)
+            executor = executors.get_executor(executor, max_workers=max_workers, **kwargs)
+        self._executor = executor
+        self._create_standard_files_object.executor = executor
+        self._automatic_qc_object.executor = executor
+        return executor
+
+    def close_executor(self):
+        if self._executor:
+            self._executor.shutdown()
+        self._executor = None
+        self._create_standard_files_object.executor = None
+        self._automatic_qc_object.executor = None
+
+    def enable_profiling(self, directory=None, interval=0.005):
+        """
+        Each stage run after this is profiled. Results are saved in a new directory per run under directory
+        (default <working directory>/profiling). See svea.profiling for the output files.
+        :param directory:
+        :param interval: seconds between stack samples
+        :return: output directory for this run
+        """
+        if not directory:
+            self._assert_directory()
+            directory = Path(self.dirs['working'], 'profiling')
+        self._set_profiler(StageProfiler(directory, interval=interval, logger=self.logger))
+        self.logger.info(f'Profiling enabled. Output is saved in: {self._profiler.directory}')
+        return self._profiler.directory
+
+    def disable_profiling(self):
+        self._set_profiler(None)
+
+    @property
+    def profiling_directory(self):
+        if not self._profiler:
+            return None
+        return self._profiler.directory
+
+    def _set_profiler(self, profiler):
+        self._profiler = profiler
+        self._create_standard_files_object.profiler = profiler
+        self._automatic_qc_object.profiler = profiler
+
+    def set_progress(self, progress_callback=None, cancel_token=None):
+        """
+        Progress is reported per cast/file as progress_callback(stage, file_name, nr_done, nr_total).
+        Stages stop between casts and raise exceptions.Cancelled when cancel_token is cancelled.
+        :param progress_callback:
+        :param cancel_token: svea.progress.CancellationToken
+        :return:
+        """
+        self._progress = Progress(callback=progress_callback, cancel_token=cancel_token, logger=self.logger)
+        self._create_metadata_file_object.progress = self._progress
+        self._create_standard_files_object.progress = self._progress
+        self._automatic_qc_object.progress = self._progress
+
+    def run_in_background(self, stage, *args, progress_callback=None, cancel_token=None, **kwargs):
+        """
+        Runs a stage in a background thread and returns a concurrent.futures.Future. Stages are run one at a time in
+        the order they are submitted. The cancellation token is available as future.cancel_token.
+        Use asyncio.wrap_future(future) (or run_async) to get an awaitable.
+        :param stage: 'sbe_processing', 'create_metadata_file', 'create_standard_format' or 'perform_automatic_qc'
+        :param args: passed to the stage method
+        :param progress_callback: see set_progress
+        :param cancel_token: svea.progress.CancellationToken. A new token is created if not given.
+        :param kwargs: passed to the stage method
+        :return:
+        """
+        if stage not in BACKGROUND_STAGES:
+            raise exceptions.SveaException(f'Invalid stage "{stage}". Stages that can run in background are: {BACKGROUND_STAGES}')
+        if not self._background_executor:
+            self._background_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                              thread_name_prefix='svea')
+        cancel_token = cancel_token or CancellationToken()
+        future = self._background_executor.submit(self._run_stage, stage, args, kwargs,
+                                                  progress_callback, cancel_token)
+        future.cancel_token = cancel_token
+        return future
+
+    async def run_async(self, stage, *args, progress_callback=None, cancel_token=None, **kwargs):
+        """ Same as run_in_background but awaitable. """
+        future = self.run_in_background(stage, *args, progress_callback=progress_callback,
+                                        cancel_token=cancel_token, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    def _run_stage(self, stage, args, kwargs, progress_callback, cancel_token):
+        self.set_progress(progress_callback=progress_callback, cancel_token=cancel_token)
+        try:
+            return getattr(self, stage)(*args, **kwargs)
+        finally:
+            self.set_progress()
+
+    @profiled_stage
     def create_metadata_file(self):
         self._assert_directory()
+        self._validate_cnv_files_before_stage()
         self._create_metadata_file_object.create_file()
         self._cnv_files_object.change_location(self.dirs['cnv_files'])
-        self._steps.create_metadata_file = True
+        self._steps.mark_done('create_metadata_file')
         return self.dirs['cnv_files']
 
+    @profiled_stage
     def create_standard_format(self):
+        """
+        If self.in_memory_handoff is True the created profiles are kept in memory for perform_automatic_qc and the
+        standard format files are written in the background.
+        :return:
+        """
         self._assert_directory()
-        self._create_standard_files_object.create_files()
-        self._steps.create_standard_format = True
+        self._validate_cnv_files_before_stage()
+        try:
+            self._create_standard_files_object.create_files(keep_in_memory=self.in_memory_handoff)
+        finally:
+            # The cnv files are not read by later stages
+            if self._create_standard_files_object.cnv_cache:
+                self._create_standard_files_object.cnv_cache.clear()
+        self._steps.mark_done('create_standard_format')
         return self._create_standard_files_object.directory
 
+    @profiled_stage
     def perform_automatic_qc(self):
+        """
+        If profiles from create_standard_format are kept in memory (see self.in_memory_handoff) the qc is run on
+        those instead of reading the standard format files from disk.
+        :return:
+        """
         self._assert_directory()
-        self._automatic_qc_object.run_qc(self.dirs['standard_files_qc'])
-        self._steps.perform_automatic_qc = True
+        in_memory_files = self._create_standard_files_object.pop_in_memory_files()
+        if in_memory_files:
+            file_names = self._automatic_qc_object.run_qc_in_memory(in_memory_files,
+                                                                    self.dirs['standard_files_qc'])
+            self._create_standard_files_object.wait_for_written_files()
+            self._automatic_qc_object.mark_checkpoints([Path(self.dirs['standard_files'], name)
+                                                        for name in file_names])
+        else:
+            self._create_standard_files_object.wait_for_written_files()
+            self._automatic_qc_object.run_qc(self.dirs['standard_files_qc'])
+        self._update_profile_index(self.dirs['standard_files_qc'])
+        self._steps.mark_done('perform_automatic_qc')
         return self.dirs['standard_files_qc']
 
-    def open_visual_qc(self, server_file_directory=None, venv_path=None, shark_package_root=None, **filters): 
-        
+    def open_visual_qc(self, server_file_directory=None, venv_path=None, shark_package_root=None, session_name=None,
+                       data_directory=None, port=None, open_browser=True, wait=False, record_flags=False, **filters):
+        """
+        Starts a visual qc session (bokeh server) and opens it in the web browser when the server is ready.
+        Several sessions can run at the same time, e.g. one per cruise or filter set.
+        :param session_name: Name of the session. A running session with the same name is shut down first.
+        :param data_directory: Directory with files to visualize. Default is the standard_format_auto_qc directory.
+        :param port: Default is a free port
+        :param open_browser:
+        :param wait: Block until the server is ready
+        :param record_flags: Record manual flag changes, see write_manual_qc_flags
+        :param filters: see VisualQC.set_options
+        :return: VisualQC session handle
+        """
+        session_name = session_name or VISUAL_QC_DEFAULT_SESSION
         if server_file_directory:
             path = Path(server_file_directory)
             if path.exists():
@@ -227,21 +645,77 @@ class SveaController:
 
         self._create_bokeh_server_source_directory(shark_package_root=shark_package_root)
 
-        if not self.dirs['standard_files_qc']:
+        data_directory = data_directory or self.dirs['standard_files_qc']
+        if not data_directory:
             raise exceptions.PathError('Path to qc standard files not set')
-        if not os.listdir(self.dirs['standard_files_qc']):
+        if not os.listdir(data_directory):
             raise exceptions.MissingFiles('Missing files to visualize')
+        # ctdvis saves flags in place. Files linked to an artifact store get private copies first.
+        unprotected = unprotect_directory(data_directory, pattern='ctd_profile*.txt')
+        if unprotected:
+            self.logger.info(f'{len(unprotected)} linked files in {data_directory} replaced by writable copies')
+
+        self.close_visual_qc(session_name)
+        visual_qc_object = VisualQC(logger=self.logger, name=session_name)
+        visual_qc_object.set_options(data_directory=data_directory,
+                                     visualize_setting=self.bokeh_visualize_setting,
+                                     server_file_directory=self.bokeh_server_directory,
+                                     venv_path=self.bokeh_server_venv_path,
+                                     port=port,
+                                     record_flags=record_flags,
+                                     **filters)
+        visual_qc_object.run(open_browser=open_browser, wait=wait)
+        self._visual_qc_sessions[session_name] = visual_qc_object
+        self._steps.mark_done('open_visual_qc')
+        return visual_qc_object
 
-        self._visual_qc_object.set_options(data_directory=self.dirs['standard_files_qc'],
-                                           visualize_setting=self.bokeh_visualize_setting,
-                                           server_file_directory=self.bokeh_server_directory,
-                                           venv_path=self.bokeh_server_venv_path,
-                                           **filters)
-        self._visual_qc_object.run()
-        self._steps.open_visual_qc = True
-        
-    def close_visual_qc(self):
-        self._visual_qc_object.kill_server()
+    @property
+    def visual_qc_sessions(self):
+        return dict(self._visual_qc_sessions)
+
+    def list_visual_qc_sessions(self):
+        """ Returns info (name, url, port, data_directory, filters, running, ready) for each session. """
+        return [session.info for session in self._visual_qc_sessions.values()]
+
+    def close_visual_qc(self, session_name=None, write_flags=True):
+        """
+        Shuts down a visual qc session.
+        :param session_name: None shuts down all sessions
+        :param write_flags: Write recorded manual flags to the files of the session, see write_manual_qc_flags
+        :return:
+        """
+        if session_name is None:
+            names = list(self._visual_qc_sessions)
+        else:
+            names = [session_name] if session_name in self._visual_qc_sessions else []
+        for name in names:
+            visual_qc_object = self._visual_qc_sessions.pop(name)
+            visual_qc_object.kill_server()
+            if write_flags and visual_qc_object.flag_log_path:
+                self.write_manual_qc_flags(visual_qc_object.data_directory)
+
+    def write_manual_qc_flags(self, data_directory=None):
+        """
+        Writes manual flags recorded by the visual qc to the standard format files. Only files with changes not
+        written before are rewritten. The log is kept so that the flags are applied again by perform_automatic_qc.
+        :param data_directory: Default is the standard_format_auto_qc directory
+        :return: list of rewritten files
+        """
+        data_directory = data_directory or self.dirs['standard_files_qc']
+        if not data_directory:
+            raise exceptions.PathError('Path to qc standard files not set')
+        rewritten = flag_deltas.write_back(data_directory, logger=self.logger)
+        if rewritten:
+            self._update_profile_index(data_directory)
+        return rewritten
+
+    def get_manual_qc_flags(self, data_directory=None):
+        """
+        Returns the manual flag changes recorded in data_directory.
+        :return: dict like {file_name: list of log entries}
+        """
+        data_directory = data_directory or self.dirs['standard_files_qc']
+        return flag_deltas.FlagDeltaLog(flag_deltas.get_log_path(data_directory)).get_entries_by_file()
 
     def _create_bokeh_server_source_directory(self, shark_package_root=None):
         if not self.bokeh_server_directory.exists():
@@ -284,13 +758,13 @@ class SveaController:
     #     #     raise exceptions.MissingSharkModules(str(missing))
 
     def send_files_to_ftp(self):
-        self._steps.send_files_to_ftp = True
+        self._steps.mark_done('send_files_to_ftp')
 
     def import_to_lims(self):
-        self._steps.import_to_lims = True
+        self._steps.mark_done('import_to_lims')
 
     def create_station_plots(self):
-        self._steps.create_station_plots = True
+        self._steps.mark_done('create_station_plots')
 
     @property
     def metadata(self):
@@ -300,6 +774,15 @@ class SveaController:
     def metadata(self, metadata):
         self._metadata_object.set(metadata)  # option to update as well (other method)
 
+    def load_sensorinfo(self, file_path, sheet_name=None):
+        """
+        Sensor info loaded before create_metadata_file is written directly into the new metadata file.
+        :param file_path: txt or xlsx file
+        :param sheet_name: needed for xlsx files
+        :return:
+        """
+        self._metadata_file_object.load_sensorinfo(file_path, sheet_name=sheet_name)
+
     @property
     def raw_files(self):
         return self._raw_files_object.file_paths
@@ -332,6 +815,18 @@ class SveaController:
 
     def set_path_standard_format_files(self, paths):
         self.standard_format_files = paths
+
+    def read_standard_format_files(self, parameters=None, typed=True, lazy=False):
+        """
+        Reads the selected standard format files (see standard_format_files) with svea.stdfmt_reader.
+        :param parameters: only these parameters are read (all if None)
+        :param typed: numeric columns as floats
+        :param lazy: return svea.stdfmt_reader.StandardFormatFile objects that parse parameters when requested
+        :return: dict with file name as key
+        """
+        if lazy:
+            return self._standard_files_object.open_files(typed=typed)
+        return self._standard_files_object.read_files(parameters=parameters, typed=typed)
         
     @property
     def standard_format_files_qc(self):
@@ -359,7 +854,91 @@ class SveaController:
         self._create_metadata_file_object.allow_overwrite = overwrite
         self._create_standard_files_object.allow_overwrite = overwrite
         self._automatic_qc_object.allow_overwrite = overwrite
-        self._ctd_processing_object.overwrite = overwrite
+        self._set_ctd_processing_options(overwrite=overwrite)
+
+    def enable_artifact_store(self, root_directory=None, link_modes=None):
+        """
+        Files placed in raw_files, cnv, standard_format and standard_format_auto_qc are stored once in a content
+        addressed store and linked into the directories. Use the same root_directory for several working
+        directories to deduplicate files across cruises (hardlinks and reflinks need the same filesystem).
+        :param root_directory: Defaults to <working directory>/artifacts
+        :param link_modes: Order of link modes to try. Default is ['reflink', 'hardlink', 'symlink', 'copy']
+        :return:
+        """
+        if not root_directory:
+            self._assert_directory()
+            root_directory = Path(self.dirs['working'], 'artifacts')
+        self._set_artifact_store(ArtifactStore(root_directory, link_modes=link_modes, logger=self.logger))
+        self.logger.info(f'Artifact store enabled at: {root_directory}')
+
+    def disable_artifact_store(self):
+        self._set_artifact_store(None)
+
+    def enable_profile_index(self, file_path=None):
+        """
+        Files in standard_format_auto_qc are added to a profile index (see svea.profile_index) when written by
+        perform_automatic_qc. Use the same file_path for several working directories to query across cruises.
+        :param file_path: Defaults to <working directory>/profile_index.sqlite
+        :return:
+        """
+        if not file_path:
+            self._assert_directory()
+            file_path = Path(self.dirs['working'], 'profile_index.sqlite')
+        self._profile_index = ProfileIndex(file_path, logger=self.logger)
+        self.logger.info(f'Profile index enabled at: {file_path}')
+
+    def disable_profile_index(self):
+        self._profile_index = None
+
+    @property
+    def profile_index(self):
+        return self._profile_index
+
+    def _assert_profile_index(self):
+        if not self._profile_index:
+            raise exceptions.SveaException('Profile index is not enabled, see enable_profile_index')
+
+    def _update_profile_index(self, directory):
+        if not self._profile_index or not directory or not Path(directory).exists():
+            return
+        self._profile_index.update_directory(directory)
+
+    def update_profile_index(self, directories=None):
+        """
+        Adds new and changed files to the profile index and removes deleted files. Unchanged files are not read.
+        :param directories: Directories with standard format files, e.g. standard_format_auto_qc of other working
+                            directories. Default is the standard_format_auto_qc directory.
+        :return: dict like {directory: {'updated': nr files, 'removed': nr files}}
+        """
+        self._assert_profile_index()
+        if directories is None:
+            directories = [self.dirs['standard_files_qc']]
+        elif isinstance(directories, (str, Path)):
+            directories = [directories]
+        return {str(directory): self._profile_index.update_directory(directory) for directory in directories}
+
+    def query_profiles(self, lat_range=None, lon_range=None, time_range=None, ships=None, serno_range=None,
+                       stations=None, directories=None, limit=None):
+        """
+        Returns the indexed profiles matching all given criteria. See svea.profile_index.ProfileIndex.query.
+        Example: query_profiles(lat_range=(56, 58), lon_range=(10, 13), time_range=('2021-01', '2021-03'), ships=['77SE'])
+        :return: pd.DataFrame with path, file_name, directory, time, lat, lon, ship, serno and station
+        """
+        self._assert_profile_index()
+        return self._profile_index.query(lat_range=lat_range, lon_range=lon_range, time_range=time_range, ships=ships,
+                                         serno_range=serno_range, stations=stations, directories=directories,
+                                         limit=limit)
+
+    @property
+    def artifact_store(self):
+        return self._cnv_files_object.artifact_store
+
+    def _set_artifact_store(self, artifact_store):
+        self._raw_files_object.artifact_store = artifact_store
+        self._cnv_files_object.artifact_store = artifact_store
+        self._standard_files_object.artifact_store = artifact_store
+        self._create_standard_files_object.artifact_store = artifact_store
+        self._automatic_qc_object.artifact_store = artifact_store
 
     def reset_paths(self):
         self.raw_files = None
@@ -373,6 +952,8 @@ class RawFiles(CommonFiles):
         self.logger = get_logger(logger)
         self._file_paths = None
         self.allow_overwrite = False
+        self.artifact_store = None
+        self.editable_files = False
 
     @property
     def file_paths(self):
@@ -518,14 +1099,30 @@ class MetadataFile:
         shutil.copyfile(self._file_path, new_file_path)
         self._file_path = new_file_path
 
-    def add_sensorinfo_from_file(self, file_path, sheet_name=None):
-        self._assert_file_exists()
+    def load_sensorinfo(self, file_path, sheet_name=None):
+        """
+        Loads sensor info without touching the metadata file. Loaded sensor info is included when the metadata file
+        is created.
+        :param file_path:
+        :param sheet_name:
+        :return:
+        """
         file_path = Path(file_path)
         if file_path.suffix == '.txt':
             self.sensor_info_object.load_txt(file_path)
         elif file_path.suffix == '.xlsx':
             self.sensor_info_object.load_xlsx_sheet(file_path, sheet_name=sheet_name)
 
+    @property
+    def sensorinfo(self):
+        if not self.sensor_info_object:
+            return {}
+        return self.sensor_info_object.data or {}
+
+    def add_sensorinfo_from_file(self, file_path, sheet_name=None):
+        self._assert_file_exists()
+        self.load_sensorinfo(file_path, sheet_name=sheet_name)
+
         wb = openpyxl.load_workbook(self._file_path)
         ws = wb['Sensorinfo']
         for key, value in self.sensor_info_object.data.items():
@@ -537,14 +1134,19 @@ class MetadataFile:
             text = f'Metadata file does not exist: {self._file_path}'
             self.logger.error(text)
             raise exceptions.MissingFiles(text)
-            
-            
+
+
 class CNVfiles(CommonFiles):
     def __init__(self, logger=None):
         self._title = 'cnv files'
         self.logger = get_logger(logger)
         self._file_paths = None
         self.allow_overwrite = False
+        self.artifact_store = None
+        # cnv files may be overwritten in place by ctd_processing
+        self.editable_files = True
+        self.invalid_files = {}
+        self._valid_signatures = {}
 
     @property
     def file_paths(self):
@@ -566,6 +1168,47 @@ class CNVfiles(CommonFiles):
         else:
             self._file_paths = [Path(file_path) for file_path in file_paths if file_path.endswith('.cnv')]
 
+    def validate(self, on_invalid='raise', quarantine_directory=None, executor=None, required_keys=None):
+        """
+        Validates the cnv files in parallel (see svea.cnv_validation). Files validated before are skipped if unchanged.
+        :param on_invalid: 'raise': raise exceptions.InvalidFileFormat,
+                           'reject': remove the invalid files from self.file_paths,
+                           'quarantine': same as reject and copy the files to quarantine_directory
+        :param quarantine_directory:
+        :param executor: see svea.executors. Default is a thread pool.
+        :param required_keys: header keys required in addition to nquan and nvalues
+        :return: dict like {file_path: list of errors} for invalid files
+        """
+        if on_invalid not in cnv_validation.ON_INVALID:
+            raise exceptions.SveaException(f'Invalid option on_invalid="{on_invalid}". Valid options are: {cnv_validation.ON_INVALID}')
+        if on_invalid == 'quarantine' and not quarantine_directory:
+            raise exceptions.PathError('No quarantine directory given')
+        if not self._file_paths:
+            return {}
+        signatures = {path: get_file_signature(path) if path.exists() else None for path in self._file_paths}
+        file_paths = [path for path in self._file_paths if not signatures[path] or
+                      self._valid_signatures.get(path) != signatures[path]]
+        start_time = time.time()
+        invalid = cnv_validation.validate_cnv_files(file_paths, executor=executor, required_keys=required_keys)
+        self.logger.debug(f'{len(file_paths)} cnv files validated in {time.time() - start_time} seconds')
+        for path in file_paths:
+            if path not in invalid:
+                self._valid_signatures[path] = signatures[path]
+        self.invalid_files = invalid
+        if not invalid:
+            return invalid
+        for path, errors in invalid.items():
+            self.logger.error(f'Invalid cnv file {path}: {"; ".join(errors)}')
+        if on_invalid == 'raise':
+            raise exceptions.InvalidFileFormat(f'Invalid cnv files: {[path.name for path in invalid]}')
+        self._file_paths = [path for path in self._file_paths if path not in invalid]
+        if on_invalid == 'quarantine':
+            cnv_validation.quarantine_files(invalid, quarantine_directory)
+            self.logger.warning(f'{len(invalid)} invalid cnv files rejected and copied to {quarantine_directory}')
+        else:
+            self.logger.warning(f'{len(invalid)} invalid cnv files rejected')
+        return invalid
+
 
 class ProfileStandardFormatFiles(CommonFiles):
     def __init__(self, logger=None):
@@ -573,6 +1216,8 @@ class ProfileStandardFormatFiles(CommonFiles):
         self.logger = get_logger(logger)
         self._file_paths = None
         self.allow_overwrite = False
+        self.artifact_store = None
+        self.editable_files = False
 
     @property
     def file_paths(self):
@@ -597,6 +1242,18 @@ class ProfileStandardFormatFiles(CommonFiles):
         self._file_paths = [path for path in file_paths if str(path.name).startswith('ctd_profile')]
         print('LEN _file_paths', len(self._file_paths))
 
+    def read_files(self, parameters=None, typed=False):
+        """ Reads the files with svea.stdfmt_reader. """
+        if not self._file_paths:
+            raise exceptions.MissingFiles('No standard files selected')
+        return stdfmt_reader.read_files(self._file_paths, parameters=parameters, typed=typed)
+
+    def open_files(self, typed=False):
+        """ Lazy mode: reads only the headers, see svea.stdfmt_reader.StandardFormatFile. No files are kept open. """
+        if not self._file_paths:
+            raise exceptions.MissingFiles('No standard files selected')
+        return stdfmt_reader.open_files(self._file_paths, typed=typed)
+
 
 class CreateMetadataFile:
     def __init__(self, logger=None):
@@ -606,19 +1263,25 @@ class CreateMetadataFile:
         self.cnv_files_object = None
 
         self.allow_overwrite = False
+        self.progress = Progress(logger=self.logger)
+        self.cnv_cache = None
 
         self.session = None
 
     def create_file(self):       
         self._assert_metadata_info_is_present()
         self._assert_cnv_files_info_is_present()
+        # One unit per cnv file read and one for the metadata file
+        self.progress.start('create_metadata_file', len(self.cnv_files_object.file_paths) + 1)
         self.session = ctdpy_session.Session(filepaths=self.cnv_files_object.file_paths,
                                              reader='smhi')
 
         datasets = self._get_datasets()
         dataset = datasets[0]
         self._update_metadata_in_dataset(dataset=dataset)
+        self.progress.check()
         self._save_file(dataset=dataset)
+        self.progress.update(Path(self.metadata_file_object.file_path).name)
 
     def change_location(self, directory):
         self._assert_cnv_files_info_is_present()
@@ -628,7 +1291,10 @@ class CreateMetadataFile:
 
     def _get_datasets(self):
         start_time = time.time()
-        datasets = self.session.read()
+        if self.cnv_cache:
+            datasets = self.cnv_cache.read(self.session, progress=self.progress)
+        else:
+            datasets = cnv_cache.read_session(self.session, progress=self.progress)
         self.logger.debug(f'{len(self.cnv_files_object.file_paths)} CNV files loaded in {time.time() - start_time} seconds.')
         return datasets
 
@@ -640,24 +1306,31 @@ class CreateMetadataFile:
         self.logger.debug('Metadata updated in dataset')
 
     def _save_file(self, dataset=None):
-        start_time = time.time()
-        save_path = self.session.save_data(dataset,
-                                           writer='metadata_template',
-                                           return_data_path=True)
-        self.logger.debug(f'Metadata file saved in {time.time() - start_time} seconds at location {save_path}')
-        source_path = Path(save_path)
-        target_path = Path(self.metadata_file_object.file_path)
-        if '.' not in target_path.name:
-            if not target_path.exists():
-                os.makedirs(target_path)
-            target_path = Path(target_path, source_path.name)
+        """
+        Metadata, sensor info and user overrides are put together in memory and written once to the final path.
+        :param dataset:
+        :return:
+        """
+        target_path = self._get_target_path()
         if target_path.exists() and not self.allow_overwrite:
             text = 'Metadata file already exists and overwrite is set to False'
             self.logger.error(text)
             raise exceptions.PermissionError(text)
-        shutil.copyfile(source_path, target_path)
+
+        workbook = MetadataWorkbook(logger=self.logger)
+        workbook.add_from_ctdpy_session(self.session, dataset)
+        workbook.add_cells('Sensorinfo', self.metadata_file_object.sensorinfo)
+        workbook.save(target_path)
         self.metadata_file_object.file_path = target_path  # Updated file_path if it was a directory
-        self.logger.debug(f'File copied to location {target_path}')
+        self.logger.debug(f'Metadata file saved at location {target_path}')
+
+    def _get_target_path(self):
+        target_path = Path(self.metadata_file_object.file_path)
+        if '.' not in target_path.name:
+            if not target_path.exists():
+                os.makedirs(target_path)
+            target_path = Path(target_path, metadata_workbook.get_file_name(self.session))
+        return target_path
         
     def _assert_metadata_info_is_present(self):
         text = ''
@@ -687,6 +1360,22 @@ class CreateStandardFormatFiles:
         self.cnv_files_object = None
 
         self.allow_overwrite = False
+        self.artifact_store = None
+        self.checkpoints = None
+        self._signatures = {}
+        self.executor = None
+        self.temp_directory = None
+        self.progress = Progress(logger=self.logger)
+        self.profiler = None
+        self.cnv_cache = None
+        self.fast_writer = False
+        self.compact_datasets = False
+        self.release_datasets = False
+        self.memory_usage = None
+
+        self._in_memory_files = None
+        self._write_executor = None
+        self._write_future = None
 
         self._directory = None
 
@@ -711,34 +1400,234 @@ class CreateStandardFormatFiles:
         self.cnv_files_object.change_location(directory, overwrite=overwrite)
         self.metadata_file_object.change_location(directory, overwrite=overwrite)
 
-    def create_files(self):
+    def create_files(self, keep_in_memory=False):
+        """
+        If checkpoints are set, casts are written one by one and casts that are already completed (with unchanged
+        cnv and metadata file) are skipped. Casts are also written one by one when progress is reported.
+        :param keep_in_memory: Keep the created profiles in memory (see pop_in_memory_files) and write the files in
+                               the background (see wait_for_written_files).
+        :return:
+        """
         self._assert_metadata_and_cnv()
         self._assert_directory()
-        all_file_paths = self.cnv_files_object.file_paths + [self.metadata_file_object.file_path]
+        self.wait_for_written_files()
+        self._in_memory_files = None
+        file_paths = self._get_file_paths_to_process()
+        self.progress.start(CHECKPOINT_STANDARD_FORMAT, len(file_paths))
+        if not file_paths:
+            self.logger.info('All standard format files are already created according to checkpoints')
+            return
+        if self.executor:
+            if keep_in_memory:
+                self.logger.warning('Profiles are created by the executor and can not be kept in memory')
+            self._create_files_with_executor(file_paths)
+            return
+        if keep_in_memory:
+            self._create_files_in_memory(file_paths)
+            return
+        all_file_paths = file_paths + [self.metadata_file_object.file_path]
         all_file_paths = [str(path) for path in all_file_paths]
         session = ctdpy_session.Session(filepaths=all_file_paths,
                                         reader='smhi')
 
         start_time = time.time()
-        datasets = session.read()
-        self.logger.debug(f'{len(self.cnv_files_object.file_paths)} CNV files and one metadata file loaded in {time.time() - start_time} seconds.')
+        datasets = self._read(session)
+        self.logger.debug(f'{len(file_paths)} CNV files and one metadata file loaded in {time.time() - start_time} seconds.')
         self.datasets = datasets
         start_time = time.time()
-        data_path = session.save_data(datasets,
-                                      writer='ctd_standard_template',
-                                      return_data_path=True,
-                                      # save_path=save_directory,
-                                      )
-
         self.logger.warning(f'Permission to overwrite existing standard format files is set to {self.allow_overwrite}')
-        for file_name in os.listdir(data_path):
+        if not self.checkpoints and not self.progress.active:
+            data_path = stdfmt_writer.save_data(session, datasets, fast=self.fast_writer)
+            self._copy_files(data_path)
+        else:
+            # Each cast is written to its own directory so that only the files of the cast are copied and recorded.
+            # The cruise files (delivery note, metadata...) are the same for all casts and are copied once.
+            cruise_files = True
+            for fid, item in datasets[0].items():
+                self.progress.check()
+                export_directory = self._get_export_directory(fid)
+                data_path = stdfmt_writer.save_data(session, [{fid: item}] + datasets[1:],
+                                                    save_path=export_directory, fast=self.fast_writer)
+                outputs = self._copy_files(data_path, cruise_files=cruise_files)
+                cruise_files = False
+                shutil.rmtree(export_directory, ignore_errors=True)
+                if self.checkpoints:
+                    name = Path(fid).name
+                    self.checkpoints.mark_done(CHECKPOINT_STANDARD_FORMAT, name, self._signatures.get(name),
+                                               outputs=outputs)
+                self.progress.update(fid)
+
+        self.logger.debug(f"Datasets saved in {time.time() - start_time} sec at location: {data_path}. Files copied to: {self._directory}")
+        self._handle_written_datasets()
+
+    def _handle_written_datasets(self):
+        self.memory_usage = handle_written_datasets(self.datasets, compact_datasets=self.compact_datasets,
+                                                    release=self.release_datasets, logger=self.logger,
+                                                    name=CHECKPOINT_STANDARD_FORMAT)
+        if self.release_datasets:
+            self.datasets = None
+
+    def _read(self, session):
+        if self.cnv_cache:
+            return self.cnv_cache.read(session)
+        return session.read()
+
+    def _create_files_in_memory(self, file_paths):
+        """
+        The ctd_standard_template writer is used as usual but the profile files are collected in memory instead of
+        being written. The files are then written in a background thread. The data of each profile is also kept as
+        the DataFrame given to the writer, with the values as written to file, so that perform_automatic_qc does not
+        need to parse the lines again.
+        """
+        all_file_paths = [str(path) for path in file_paths + [self.metadata_file_object.file_path]]
+        session = ctdpy_session.Session(filepaths=all_file_paths,
+                                        reader='smhi')
+        start_time = time.time()
+        datasets = self._read(session)
+        self.logger.debug(f'{len(file_paths)} CNV files and one metadata file loaded in {time.time() - start_time} seconds.')
+        self.datasets = datasets
+
+        writer = stdfmt_writer.load_writer(session, fast=self.fast_writer)
+        files_to_write = {}
+        outputs = {}
+        in_memory_files = {}
+        data_frames = []
+        get_data_serie = writer._get_data_serie
+
+        def keep_data_frame(df, separator=None):
+            data_frames.append(df)
+            return get_data_serie(df, separator=separator)
+
+        def keep_in_memory(fid, data_series, **kwargs):
+            save_path = writer._get_save_path(fid, **kwargs)
+            files_to_write[save_path] = data_series
+            name = Path(save_path).name
+            if not is_profile_file_name(name):
+                # Delivery note and information file
+                return
+            self.progress.check()
+            outputs.setdefault(Path(fid).name, []).append(name)
+            in_memory_files[name] = {'data': stdfmt_writer.get_text_data(data_frames.pop()),
+                                     'metadata_lines': stdfmt_reader.parse_metadata(data_series)}
+            self.progress.update(name)
+
+        writer._get_data_serie = keep_data_frame
+        writer._write = keep_in_memory
+        writer.write(datasets)
+        self._handle_written_datasets()
+        self._in_memory_files = in_memory_files
+
+        if not self._write_executor:
+            self._write_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._write_future = self._write_executor.submit(self._write_files, files_to_write, writer.data_path,
+                                                         file_paths, outputs)
+
+    def _write_files(self, files_to_write, data_path, file_paths, outputs=None):
+        start_time = time.time()
+        for save_path, lines in files_to_write.items():
+            if self.fast_writer:
+                stdfmt_writer.write_lines(lines, save_path)
+            else:
+                np.savetxt(save_path, lines, fmt='%s')
+        self._copy_files(data_path)
+        if self.checkpoints:
+            outputs = outputs or {}
+            self.checkpoints.mark_many_done(CHECKPOINT_STANDARD_FORMAT,
+                                            {path.name: (self._signatures.get(path.name), outputs.get(path.name))
+                                             for path in file_paths})
+        self.logger.debug(f"Datasets saved in {time.time() - start_time} sec at location: {data_path}. Files copied to: {self._directory}")
+
+    def pop_in_memory_files(self):
+        """
+        Returns the profiles kept in memory by the last call to create_files(keep_in_memory=True) and releases them.
+        :return: dict like {file_name: {'data': pd.DataFrame, 'metadata_lines': pd.Series}}
+        """
+        in_memory_files = self._in_memory_files
+        self._in_memory_files = None
+        return in_memory_files
+
+    def wait_for_written_files(self):
+        """ Blocks until standard format files kept in memory are written (and raises if the writing failed). """
+        if not self._write_future:
+            return
+        future = self._write_future
+        self._write_future = None
+        future.result()
+
+    def _create_files_with_executor(self, file_paths):
+        """ One work unit per cnv file. Units write to separate directories under self.temp_directory. """
+        start_time = time.time()
+        units = {}
+        for path in file_paths:
+            export_directory = self._get_export_directory(path)
+            units[path] = (create_standard_format_file,
+                           (str(path), str(self.metadata_file_object.file_path)),
+                           dict(export_directory=export_directory,
+                                cache_directory=self._get_cache_directory(),
+                                fast_writer=self.fast_writer))
+        profiled_units = self.profiler.wrap_units(CHECKPOINT_STANDARD_FORMAT, units, self.executor) if self.profiler else units
+        failed = []
+        cruise_files = True
+        for path, future in executors.iter_completed(self.executor, profiled_units, progress=self.progress):
+            export_directory = units[path][2]['export_directory']
+            if future.exception():
+                self.logger.error(f'Could not create standard format file for {path.name}: {future.exception()}')
+                failed.append(path.name)
+                self.progress.update(path.name)
+                continue
+            outputs = self._copy_files(future.result(), cruise_files=cruise_files)
+            cruise_files = False
+            shutil.rmtree(export_directory, ignore_errors=True)
+            if self.checkpoints:
+                self.checkpoints.mark_done(CHECKPOINT_STANDARD_FORMAT, path.name, self._signatures.get(path.name),
+                                           outputs=outputs)
+            self.progress.update(path.name)
+        self.logger.debug(f'{len(file_paths) - len(failed)} standard format files created in {time.time() - start_time} sec. Files copied to: {self._directory}')
+        if failed:
+            raise exceptions.SveaException(f'Could not create standard format files for: {failed}')
+
+    def _get_cache_directory(self):
+        """ Workers can only share the cache if it is persisted. """
+        if not self.cnv_cache or not self.cnv_cache.persist:
+            return None
+        return str(self.cnv_cache.directory)
+
+    def _get_export_directory(self, path):
+        temp_directory = self.temp_directory or Path(self._directory.parent, 'temp')
+        return str(Path(temp_directory, 'standard_format', Path(path).stem))
+
+    def _get_file_paths_to_process(self):
+        if not self.checkpoints:
+            return self.cnv_files_object.file_paths
+        metadata_signature = get_file_signature(self.metadata_file_object.file_path)
+        self._signatures = {path.name: f'{get_file_signature(path)}_{metadata_signature}'
+                            for path in self.cnv_files_object.file_paths}
+        file_paths = []
+        for path in self.cnv_files_object.file_paths:
+            if self.checkpoints.is_done(CHECKPOINT_STANDARD_FORMAT, path.name, self._signatures[path.name],
+                                        directory=self._directory):
+                continue
+            file_paths.append(path)
+        self.logger.info(f'{len(self.cnv_files_object.file_paths) - len(file_paths)} of '
+                         f'{len(self.cnv_files_object.file_paths)} cnv files already processed according to checkpoints')
+        return file_paths
+
+    def _copy_files(self, data_path, cruise_files=True):
+        """
+        Returns the names of the profile files in data_path.
+        :param data_path:
+        :param cruise_files: False to only copy the profile files (not the delivery note, metadata etc.)
+        :return:
+        """
+        profile_file_names = get_profile_file_names(data_path)
+        file_names = os.listdir(data_path) if cruise_files else profile_file_names
+        for file_name in file_names:
             source_path = Path(data_path, file_name)
             target_path = Path(self._directory, file_name)
             if target_path.exists() and not self.allow_overwrite:
                 continue
-            shutil.copyfile(source_path, target_path)
-
-        self.logger.debug(f"Datasets saved in {time.time() - start_time} sec at location: {data_path}. Files copied to: {self._directory}")
+            place_file(source_path, target_path, artifact_store=self.artifact_store)
+        return profile_file_names
 
     def _assert_directory(self):
         if not self._directory:
@@ -770,51 +1659,226 @@ class AutomaticQC:
         self.logger = get_logger(logger)
         # self._file_paths = None
         self.allow_overwrite = False
+        self.artifact_store = None
+        self.checkpoints = None
+        self._signatures = {}
+        self.executor = None
+        self.temp_directory = None
+        self.progress = Progress(logger=self.logger)
+        self.profiler = None
+        self.fast_writer = False
+        self.fast_reader = True
+        self.compact_datasets = False
+        self.release_datasets = False
+        self.memory_usage = None
+        self.datasets = None
+        self.apply_manual_flags = True
 
         self.standard_files_object = None
 
     def run_qc(self, output_directory=None):
+        """
+        If checkpoints are set, files are qc-ed and written one by one and files that are already completed
+        (and unchanged) are skipped. Files are also written one by one when progress is reported.
+        Manual flags recorded in output_directory (see svea.flag_deltas) are applied after the automatic qc.
+        :param output_directory:
+        :return:
+        """
         files = self.standard_files_object.file_paths
         if not files:
             raise exceptions.MissingFiles('No standard files selected')
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory)
+        files = self._get_file_paths_to_process(files, output_directory)
+        self.progress.start(CHECKPOINT_AUTOMATIC_QC, len(files))
+        if not files:
+            self.logger.info('All standard format files are already qc-ed according to checkpoints')
+            return output_directory
+        manual_flags = self._get_manual_flags(output_directory)
+        if self.executor:
+            self._run_qc_with_executor(files, output_directory, manual_flags=manual_flags)
+            return output_directory
         session = ctdpy_session.Session(filepaths=files,
                                         reader='ctd_stdfmt')
 
-        datasets = session.read()
+        datasets = read_standard_format_files(session, files, fast=self.fast_reader, logger=self.logger)
+        self.datasets = datasets
 
+        write_per_file = self.checkpoints or self.progress.active
         for data_key, item in datasets[0].items():
             # print(data_key)
+            self.progress.check()
             parameter_mapping = get_reversed_dictionary(session.settings.pmap, item['data'].keys())
             qc_run = QCBlueprint(item, parameter_mapping=parameter_mapping)
             qc_run()
+            flag_deltas.apply_entries(item['data'], manual_flags.get(data_key, []))
+            if write_per_file:
+                export_directory = self._get_export_directory(data_key, output_directory)
+                data_path = stdfmt_writer.save_data(session, [{data_key: item}], save_path=export_directory,
+                                                    fast=self.fast_writer)
+                outputs = self._copy_files(data_path, output_directory)
+                shutil.rmtree(export_directory, ignore_errors=True)
+                if self.checkpoints:
+                    name = Path(data_key).name
+                    self.checkpoints.mark_done(CHECKPOINT_AUTOMATIC_QC, name, self._signatures.get(name),
+                                               outputs=outputs)
+            self.progress.update(data_key)
+
+        if not write_per_file:
+            data_path = stdfmt_writer.save_data(session, datasets, fast=self.fast_writer)
+            self._copy_files(data_path, output_directory)
+
+        self._handle_written_datasets()
+        return output_directory
 
-        data_path = session.save_data(datasets,
-                                      writer='ctd_standard_template', return_data_path=True,
-                                      # save_path='C:/ctdpy_exports',
-                                      )
-
+    def run_qc_in_memory(self, in_memory_files, output_directory=None):
+        """
+        Runs qc on profiles kept in memory by CreateStandardFormatFiles. The data is used as is and the metadata is
+        parsed the same way as when the files are read with read_standard_format_files.
+        :param in_memory_files: dict like {file_name: {'data': pd.DataFrame, 'metadata_lines': pd.Series}}
+        :param output_directory:
+        :return: list of file names
+        """
         if not os.path.exists(output_directory):
             os.makedirs(output_directory)
+        self.progress.start(CHECKPOINT_AUTOMATIC_QC, len(in_memory_files))
+        session = ctdpy_session.Session()
+        reader_settings = session.settings.readers['ctd_stdfmt']
+        session.update_settings_attributes(**reader_settings)
+        reader = session.load_reader(reader_settings['file_types']['stdfmt'])
+
+        datasets = [{}]
+        for file_name, item in in_memory_files.items():
+            datasets[0][file_name] = {'data': item['data'],
+                                      'metadata': stdfmt_reader.parse_metadata(item['metadata_lines'],
+                                                                               get_metadata=reader.get_metadata,
+                                                                               file_name=file_name)}
+        self.datasets = datasets
+        manual_flags = self._get_manual_flags(output_directory)
+
+        write_per_file = self.progress.active
+        for data_key, item in datasets[0].items():
+            self.progress.check()
+            parameter_mapping = get_reversed_dictionary(session.settings.pmap, item['data'].keys())
+            qc_run = QCBlueprint(item, parameter_mapping=parameter_mapping)
+            qc_run()
+            flag_deltas.apply_entries(item['data'], manual_flags.get(data_key, []))
+            if write_per_file:
+                export_directory = self._get_export_directory(data_key, output_directory)
+                data_path = stdfmt_writer.save_data(session, [{data_key: item}], save_path=export_directory,
+                                                    fast=self.fast_writer)
+                self._copy_files(data_path, output_directory)
+                shutil.rmtree(export_directory, ignore_errors=True)
+            self.progress.update(data_key)
+
+        if not write_per_file:
+            data_path = stdfmt_writer.save_data(session, datasets, fast=self.fast_writer)
+            self._copy_files(data_path, output_directory)
+        file_names = list(datasets[0])
+        self._handle_written_datasets()
+        return file_names
+
+    def _handle_written_datasets(self):
+        self.memory_usage = handle_written_datasets(self.datasets, compact_datasets=self.compact_datasets,
+                                                    release=self.release_datasets, logger=self.logger,
+                                                    name=CHECKPOINT_AUTOMATIC_QC)
+        if self.release_datasets:
+            self.datasets = None
+
+    def _get_manual_flags(self, output_directory):
+        """ Returns the manual flag changes recorded in output_directory as {file_name: list of log entries}. """
+        if not self.apply_manual_flags:
+            return {}
+        manual_flags = flag_deltas.FlagDeltaLog(flag_deltas.get_log_path(output_directory)).get_entries_by_file()
+        if manual_flags:
+            self.logger.info(f'Manual qc flags for {len(manual_flags)} files are applied after the automatic qc')
+        return manual_flags
+
+    def mark_checkpoints(self, file_paths):
+        """ Marks standard format files as qc-ed. The files need to be on disk. """
+        if not self.checkpoints:
+            return
+        self.checkpoints.mark_many_done(CHECKPOINT_AUTOMATIC_QC,
+                                        {path.name: (get_file_signature(path), [path.name])
+                                         for path in file_paths if path.exists()})
+
+    def _run_qc_with_executor(self, file_paths, output_directory, manual_flags=None):
+        """ One work unit per standard format file. Units write to separate directories under self.temp_directory. """
+        manual_flags = manual_flags or {}
+        units = {}
+        for path in file_paths:
+            export_directory = self._get_export_directory(path, output_directory)
+            units[Path(path)] = (automatic_qc_file, (str(path), ), dict(export_directory=export_directory,
+                                                                         fast_writer=self.fast_writer,
+                                                                         fast_reader=self.fast_reader,
+                                                                         manual_flags=manual_flags.get(Path(path).name)))
+        profiled_units = self.profiler.wrap_units(CHECKPOINT_AUTOMATIC_QC, units, self.executor) if self.profiler else units
+        failed = []
+        for path, future in executors.iter_completed(self.executor, profiled_units, progress=self.progress):
+            export_directory = units[path][2]['export_directory']
+            if future.exception():
+                self.logger.error(f'Automatic qc failed for {path.name}: {future.exception()}')
+                failed.append(path.name)
+                self.progress.update(path.name)
+                continue
+            outputs = self._copy_files(future.result(), output_directory)
+            shutil.rmtree(export_directory, ignore_errors=True)
+            if self.checkpoints:
+                self.checkpoints.mark_done(CHECKPOINT_AUTOMATIC_QC, path.name, self._signatures.get(path.name),
+                                           outputs=outputs)
+            self.progress.update(path.name)
+        if failed:
+            raise exceptions.SveaException(f'Automatic qc failed for: {failed}')
+
+    def _get_file_paths_to_process(self, file_paths, output_directory=None):
+        if not self.checkpoints:
+            return file_paths
+        self._signatures = {path.name: get_file_signature(path) for path in file_paths}
+        file_paths = [path for path in file_paths if not self.checkpoints.is_done(CHECKPOINT_AUTOMATIC_QC,
+                                                                                  path.name,
+                                                                                  self._signatures[path.name],
+                                                                                  directory=output_directory)]
+        self.logger.info(f'{len(self._signatures) - len(file_paths)} of {len(self._signatures)} '
+                         f'standard format files already qc-ed according to checkpoints')
+        return file_paths
+
+    def _get_export_directory(self, path, output_directory):
+        temp_directory = self.temp_directory or Path(Path(output_directory).parent, 'temp')
+        return str(Path(temp_directory, 'automatic_qc', Path(path).stem))
+
+    def _copy_files(self, data_path, output_directory):
         for file_name in os.listdir(data_path):
             source_path = Path(data_path, file_name)
             target_path = Path(output_directory, file_name)
             if target_path.exists() and not self.allow_overwrite:
                 continue
-            shutil.copyfile(source_path, target_path)
-
-        return output_directory
+            # Files in the qc directory are edited in place by the visual qc (ctdvis)
+            place_file(source_path, target_path, artifact_store=self.artifact_store, editable=True)
+        return get_profile_file_names(data_path)
 
 
 class VisualQC:
-    def __init__(self, logger=None):
+    """
+    One visual qc session: a bokeh server with its own server file and port. Several sessions can run at the same
+    time, see SveaController.open_visual_qc.
+    """
+    def __init__(self, logger=None, name=None):
         self.logger = get_logger(logger)
-        self.bokeh_server_file_name = 'run_bokeh_server.py'
+        self.name = name or VISUAL_QC_DEFAULT_SESSION
+        self.bokeh_server_file_name = get_bokeh_server_file_name(self.name)
         self.bokeh_server_file_path = Path()
         # self.run_bokeh_server_batch_file_path = Path(Path(__file__).parent, 'temp', 'run_bokeh_server.bat')
         # if not self.run_bokeh_server_batch_file_path.parent.exists():
         #     os.makedirs(self.run_bokeh_server_batch_file_path.parent)
         self.url_base = None
         self.lines = []
+        self.port = None
+        self.venv_path = None
+        self.data_directory = None
+        self.filters = {}
+        self.flag_log_path = None
+        self.bokeh_subprocess = None
+        self.ready = threading.Event()
 
     def __repr__(self):
         str_list = ['Filter options are:']
@@ -822,13 +1886,54 @@ class VisualQC:
             str_list.append(s)
         return '\n'.join(str_list)
 
-    def set_options(self, data_directory=None, visualize_setting='', server_file_directory=None, venv_path=None, **filters):
+    @property
+    def url(self):
+        if not self.url_base:
+            return None
+        return self.url_base + self.bokeh_server_file_path.stem
+
+    @property
+    def is_running(self):
+        return self.bokeh_subprocess is not None and self.bokeh_subprocess.poll() is None
+
+    @property
+    def info(self):
+        return {'name': self.name,
+                'url': self.url,
+                'port': self.port,
+                'data_directory': self.data_directory,
+                'filters': self.filters,
+                'flag_log_path': self.flag_log_path,
+                'running': self.is_running,
+                'ready': self.ready.is_set()}
+
+    def set_options(self, data_directory=None, visualize_setting='', server_file_directory=None, venv_path=None,
+                    downsampling=None, downsampling_points=1000, downsampling_key_parameters=None, port=None,
+                    record_flags=False, **filters):
+        """
+        :param downsampling: None, 'lttb' or 'minmax'. Profiles are downsampled on the server before they are sent to
+                             the browser. The selected profile is loaded in full resolution. See svea.downsampling.
+        :param downsampling_points: number of points per profile when downsampling
+        :param downsampling_key_parameters: columns of the profile sources that keep their shape first when
+                                            downsampling_points is too small for all parameters
+        :param port: port of the bokeh server. A free port is used if not given.
+        :param record_flags: Manual flag changes are recorded to <data_directory>/manual_qc_flags.jsonl. See
+                             svea.flag_deltas and SveaController.write_manual_qc_flags.
+        """
+        if downsampling and downsampling not in downsampling_module.METHODS:
+            raise exceptions.SveaException(f'Invalid downsampling "{downsampling}". Valid options are: {downsampling_module.METHODS}')
+        self.port = port or get_free_port()
+        self.venv_path = venv_path
+        self.data_directory = data_directory
+        self.filters = filters
+        self.flag_log_path = flag_deltas.get_log_path(data_directory) if record_flags else None
         template_source_path = Path(Path(__file__).parent, 'templates', 'bokeh_server_template.py')
         self.lines = []
         with open(template_source_path) as fid:
             for line in fid:
                 if line.startswith('URL'):
-                    self.url_base = line.split('=')[1].strip().strip('"').strip("'")
+                    self.url_base = f'http://localhost:{self.port}/'
+                    line = f'URL = "{self.url_base}"\n'
                 elif line.startswith('DATA_DIR'):
                     line = f'DATA_DIR = r"{data_directory}"\n'
                 elif filters.get('month_list') and line.startswith('MONTH_LIST'):
@@ -841,10 +1946,25 @@ class VisualQC:
                     line = f'SERNO_MAX = {filters.get("serno_max")}\n'
                 elif visualize_setting and line.startswith('VISUALIZE_SETTINGS'):
                     line = f'VISUALIZE_SETTINGS = "{visualize_setting}"\n'
+                elif downsampling and line.startswith('DOWNSAMPLING ='):
+                    line = f'DOWNSAMPLING = "{downsampling}"\n'
+                elif downsampling and line.startswith('DOWNSAMPLING_POINTS'):
+                    line = f'DOWNSAMPLING_POINTS = {int(downsampling_points)}\n'
+                elif downsampling and downsampling_key_parameters and line.startswith('DOWNSAMPLING_KEY_PARAMETERS'):
+                    line = f'DOWNSAMPLING_KEY_PARAMETERS = {list(downsampling_key_parameters)}\n'
+                elif record_flags and line.startswith('FLAG_LOG ='):
+                    line = f'FLAG_LOG = r"{self.flag_log_path}"\n'
                 self.lines.append(line)
 
         self._save_server_file(server_file_directory)
-        self._create_batch_file(server_file_directory, venv_path)
+        if downsampling:
+            # Imported by the server file
+            shutil.copy2(downsampling_module.__file__, Path(server_file_directory, 'svea_downsampling.py'))
+        if record_flags:
+            shutil.copy2(flag_deltas.__file__, Path(server_file_directory, 'svea_flag_deltas.py'))
+        if os.name == 'nt':
+            # For starting the server manually
+            self._create_batch_file(server_file_directory, venv_path)
 
     def _save_server_file(self, directory):
         if not self.lines:
@@ -854,30 +1974,109 @@ class VisualQC:
             fid.write(''.join(self.lines))
 
     def _create_batch_file(self, directory, venv_path):
-        self.run_bokeh_server_batch_file_path = Path(directory, 'run_bokeh_server.bat')
+        self.run_bokeh_server_batch_file_path = Path(directory, f'{self.bokeh_server_file_path.stem}.bat')
         with open(self.run_bokeh_server_batch_file_path, 'w') as fid:
             fid.write(f'call {str(venv_path)}/Scripts/activate\n')
             fid.write(f'cd {str(self.bokeh_server_file_path.parent)}\n')
-            fid.write(f'bokeh serve {self.bokeh_server_file_name}')
-            
+            fid.write(f'bokeh serve {self.bokeh_server_file_name} --port {self.port}')
+
+    def _get_server_command(self):
+        return [str(get_venv_python(self.venv_path)), '-m', 'bokeh', 'serve', self.bokeh_server_file_name,
+                '--port', str(self.port),
+                '--allow-websocket-origin', f'localhost:{self.port}']
+
     def _run_server(self):
-        self.bokeh_subprocess = subprocess.Popen(str(self.run_bokeh_server_batch_file_path), 
-                                                 shell=False, stdout=subprocess.PIPE)
-        
-    def kill_server(self):
-        if hasattr(self, 'bokeh_subprocess'):
-            print('killing server')
-            self.bokeh_subprocess.kill()
-            print('It worked')
+        if self.is_running:
+            raise exceptions.SveaException(f'Visual qc session "{self.name}" is already running at {self.url}')
+        self.ready.clear()
+        log_file_path = Path(self.bokeh_server_file_path.parent, f'{self.bokeh_server_file_path.stem}.log')
+        with open(log_file_path, 'w') as log_fid:
+            self.bokeh_subprocess = subprocess.Popen(self._get_server_command(),
+                                                     cwd=str(self.bokeh_server_file_path.parent),
+                                                     shell=False,
+                                                     stdout=log_fid,
+                                                     stderr=subprocess.STDOUT)
+        self.logger.info(f'Visual qc session "{self.name}" started at {self.url}. Server log: {log_file_path}')
+
+    def kill_server(self, timeout=10):
+        if not self.bokeh_subprocess:
+            return
+        if self.is_running:
+            self.bokeh_subprocess.terminate()
+            try:
+                self.bokeh_subprocess.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.bokeh_subprocess.kill()
+                self.bokeh_subprocess.wait()
+        self.bokeh_subprocess = None
+        self.ready.clear()
+        self.logger.info(f'Visual qc session "{self.name}" shut down')
+
+    def wait_until_ready(self, timeout=60):
+        """
+        Waits until the bokeh server answers http requests. The app itself is not requested since that would load
+        all data for a session that is not used.
+        """
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            if not self.is_running:
+                raise exceptions.SveaException(f'Bokeh server for visual qc session "{self.name}" stopped')
+            connection = http.client.HTTPConnection('localhost', self.port, timeout=1)
+            try:
+                connection.request('HEAD', '/')
+                connection.getresponse()
+                self.ready.set()
+                return True
+            except OSError:
+                time.sleep(0.2)
+            finally:
+                connection.close()
+        raise exceptions.SveaException(f'Bokeh server for visual qc session "{self.name}" not ready after {timeout} seconds')
 
     def _open_webbrowser(self):
-        url = self.url_base + self.bokeh_server_file_path.stem
-        webbrowser.open(url=url)
+        webbrowser.open(url=self.url)
 
-    def run(self):
-        self._run_server()
+    def _open_webbrowser_when_ready(self, timeout):
+        try:
+            self.wait_until_ready(timeout=timeout)
+        except exceptions.SveaException as e:
+            self.logger.error(str(e))
+            return
         self._open_webbrowser()
 
+    def run(self, open_browser=True, wait=False, timeout=60):
+        """
+        Starts the bokeh server. The web page is opened when the server is ready.
+        :param open_browser:
+        :param wait: Block until the server is ready. Otherwise the readiness is checked in a background thread.
+        :param timeout: seconds to wait for the server
+        :return:
+        """
+        self._run_server()
+        if wait:
+            self.wait_until_ready(timeout=timeout)
+            if open_browser:
+                self._open_webbrowser()
+        elif open_browser:
+            threading.Thread(target=self._open_webbrowser_when_ready, args=(timeout, ), daemon=True).start()
+
+
+def get_free_port(host='localhost'):
+    """ Returns a port that is free at the moment. """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+def get_venv_python(venv_path):
+    if os.name == 'nt':
+        return Path(venv_path, 'Scripts', 'python.exe')
+    return Path(venv_path, 'bin', 'python')
+
+def get_bokeh_server_file_name(session_name):
+    if session_name == VISUAL_QC_DEFAULT_SESSION:
+        return 'run_bokeh_server.py'
+    name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(session_name))
+    return f'run_bokeh_server_{name}.py'
 
 def get_logger(existing_logger=None):
     if existing_logger:
@@ -888,6 +2087,90 @@ def get_logger(existing_logger=None):
     logger = logging.getLogger('timedrotating')
     return logger
 
+def is_profile_file_name(file_name):
+    return file_name.startswith('ctd_profile')
+
+def get_profile_file_names(directory):
+    """ Names of the standard format profile files in directory (the writer also writes delivery note etc.) """
+    return sorted(name for name in os.listdir(directory) if is_profile_file_name(name))
+
+def handle_written_datasets(datasets, compact_datasets=False, release=False, logger=None, name=''):
+    """
+    Releases or compacts datasets that have been written to file. Released datasets are not compacted first.
+    :return: dict like {'before': bytes, 'after': bytes} or None if neither compact nor release
+    """
+    if not datasets or not (compact_datasets or release):
+        return None
+    if not release:
+        return compact.compact_datasets(datasets, logger=logger, name=name)
+    before = compact.get_memory_usage(datasets)
+    compact.release_datasets(datasets)
+    after = compact.get_memory_usage(datasets)
+    get_logger(logger).info(f'Datasets {name} released: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB')
+    return {'before': before, 'after': after, 'released': True}
+
+def read_standard_format_files(session, file_paths, fast=True, logger=None):
+    """
+    Same as session.read() for a ctdpy session created with reader='ctd_stdfmt'. With fast=True the data is read
+    with svea.stdfmt_reader and only the metadata is parsed by the ctdpy reader.
+    """
+    if not fast:
+        return session.read()
+    reader = list(session.readers.values())[0]['reader']
+    try:
+        return [stdfmt_reader.read_files(file_paths, get_metadata=reader.get_metadata)]
+    except exceptions.InvalidFileFormat as e:
+        get_logger(logger).warning(f'Could not use fast reader ({e}). Reading with ctdpy.')
+        return session.read()
+
+def sbe_process_file(file_path, **options):
+    """
+    Work unit: SBE processing of one file.
+    :param file_path:
+    :param options: see SveaController.ctd_processing_options
+    :return:
+    """
+    ctd_processing_object = CtdProcessing(logger=logging.getLogger('svea'))
+    for key, value in options.items():
+        setattr(ctd_processing_object, key, value)
+    ctd_processing_object.load_seabird_files(file_path)
+    ctd_processing_object.run_process()
+    return file_path
+
+def create_standard_format_file(cnv_file_path, metadata_file_path, export_directory=None, cache_directory=None,
+                                fast_writer=False):
+    """
+    Work unit: creates the standard format file for one cnv file.
+    :param cache_directory: directory of a persisted CNVParseCache
+    :param fast_writer: write with svea.stdfmt_writer
+    :return: directory with the created files
+    """
+    session = ctdpy_session.Session(filepaths=[str(cnv_file_path), str(metadata_file_path)],
+                                    reader='smhi')
+    if cache_directory:
+        datasets = CNVParseCache(cache_directory, persist=True).read(session)
+    else:
+        datasets = session.read()
+    return stdfmt_writer.save_data(session, datasets, save_path=export_directory, fast=fast_writer)
+
+def automatic_qc_file(file_path, export_directory=None, fast_writer=False, fast_reader=True, manual_flags=None):
+    """
+    Work unit: runs automatic qc on one standard format file.
+    :param fast_writer: write with svea.stdfmt_writer
+    :param fast_reader: read with svea.stdfmt_reader
+    :param manual_flags: list of svea.flag_deltas log entries applied after the automatic qc
+    :return: directory with the created files
+    """
+    session = ctdpy_session.Session(filepaths=[str(file_path)],
+                                    reader='ctd_stdfmt')
+    datasets = read_standard_format_files(session, [file_path], fast=fast_reader)
+    for data_key, item in datasets[0].items():
+        parameter_mapping = get_reversed_dictionary(session.settings.pmap, item['data'].keys())
+        qc_run = QCBlueprint(item, parameter_mapping=parameter_mapping)
+        qc_run()
+        flag_deltas.apply_entries(item['data'], manual_flags or [])
+    return stdfmt_writer.save_data(session, datasets, save_path=export_directory, fast=fast_writer)
+
 def get_directrory_path_for_string(root, string):
     for root, dirs, files in os.walk(root, topdown=False):
         # for name in files:
@@ -0,0 +1,242 @@
+"""
+Server side downsampling of profiles for the visual qc (ctdvis) bokeh server.
+
+All profiles are sent to the browser when the qc tool is opened. With downsampling the profile sources and the TS
+source only hold a shape preserving subset of each profile:
+    lttb:   Largest-Triangle-Three-Buckets
+    minmax: min and max value per bin
+nr_points is the number of points kept per profile. The budget is shared by the parameters: indices are calculated
+per parameter along the profile with nr_points // nr_parameters points each and combined, so all parameters keep
+their extremes. If there are more parameters than the budget allows, only the first parameters are used (the
+parameters given in key_parameters first). When a profile is selected for flagging its full resolution data is sent
+to the browser. The flag buttons are disabled until then, since ctdvis flags the rows given by the selected points.
+
+The module only depends on numpy (and bokeh in downsample_qc_tool) since it is copied to and imported by the bokeh
+server file (see VisualQC.set_options).
+"""
+import numpy as np
+
+METHODS = ['lttb', 'minmax']
+
+# Tag of the profile sources that hold downsampled data (removed in the browser when the full data arrives)
+DOWNSAMPLED_TAG = 'svea_downsampled'
+
+# Smallest number of points per parameter for each method: first, last and one point or one bin (min and max)
+MIN_POINTS = {'lttb': 3, 'minmax': 4}
+
+
+def lttb_indices(t, v, nr_points):
+    """
+    Largest-Triangle-Three-Buckets.
+    :param t: x-axis of the series (e.g. pressure or index)
+    :param v: values
+    :param nr_points: number of points to keep
+    :return: sorted array of indices to keep
+    """
+    t = np.asarray(t, dtype=float)
+    v = np.asarray(v, dtype=float)
+    length = len(v)
+    if nr_points >= length or nr_points < 3:
+        return np.arange(length)
+    bucket_edges = np.linspace(1, length - 1, nr_points - 1).astype(int)
+    indices = np.empty(nr_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = length - 1
+    a = 0
+    for i in range(nr_points - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        next_start, next_end = bucket_edges[i + 1], bucket_edges[i + 2] if i + 2 < len(bucket_edges) else length
+        mean_t = t[next_start:next_end].mean()
+        mean_v = v[next_start:next_end].mean()
+        if end > start:
+            areas = np.abs((t[a] - mean_t) * (v[start:end] - v[a]) - (t[a] - t[start:end]) * (mean_v - v[a]))
+            a = start + int(np.argmax(areas))
+        else:
+            a = start
+        indices[i + 1] = a
+    return np.unique(indices)
+
+
+def minmax_indices(v, nr_points):
+    """
+    First and last value and min and max per bin. (nr_points - 2) / 2 bins of equal number of values.
+    :return: sorted array of at most nr_points indices to keep
+    """
+    v = np.asarray(v, dtype=float)
+    length = len(v)
+    if nr_points >= length:
+        return np.arange(length)
+    nr_bins = (nr_points - 2) // 2
+    if nr_bins < 1:
+        return np.array([0, length - 1][:max(nr_points, 0)], dtype=int)
+    edges = np.linspace(0, length, nr_bins + 1).astype(int)
+    bin_nr = np.repeat(np.arange(nr_bins), np.diff(edges))
+    order = np.lexsort((v, bin_nr))
+    counts = np.diff(edges)
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    min_indices = order[first]
+    max_indices = order[first + counts - 1]
+    return np.unique(np.concatenate(([0, length - 1], min_indices, max_indices)))
+
+
+def get_indices(values_list, nr_points=1000, method='lttb', t=None):
+    """
+    Indices to keep so that every series in values_list keeps its shape. NaN values are ignored.
+    :param values_list: list of arrays of equal length. If nr_points is too small for all series only the first
+                        series are used.
+    :param nr_points: max number of indices returned, shared by the series
+    :param method: 'lttb' or 'minmax'
+    :param t: x-axis for lttb. Default is the index.
+    :return: sorted array of indices
+    """
+    if method not in METHODS:
+        raise ValueError(f'Invalid downsampling method "{method}". Valid methods are: {METHODS}')
+    if not values_list:
+        return np.array([], dtype=int)
+    length = len(values_list[0])
+    if length <= nr_points:
+        return np.arange(length)
+    t = np.arange(length, dtype=float) if t is None else np.asarray(t, dtype=float)
+    keep = [np.array([0, length - 1])]
+    # First and last index are always kept
+    budget = nr_points - 2
+    nr_series = min(len(values_list), max(budget // MIN_POINTS[method], 1))
+    points = budget // nr_series
+    if points < MIN_POINTS[method]:
+        return np.unique(keep[0])
+    for values in values_list[:nr_series]:
+        values = np.asarray(values, dtype=float)
+        finite = np.flatnonzero(np.isfinite(values) & np.isfinite(t))
+        if not len(finite):
+            continue
+        if method == 'lttb':
+            idx = lttb_indices(t[finite], values[finite], points)
+        else:
+            idx = minmax_indices(values[finite], points)
+        keep.append(finite[idx])
+    return np.unique(np.concatenate(keep))
+
+
+def _numeric_columns(data, exclude=()):
+    columns = []
+    for key, values in data.items():
+        if key in exclude:
+            continue
+        values = np.asarray(values)
+        if np.issubdtype(values.dtype, np.number):
+            columns.append(key)
+    return columns
+
+
+def downsample_data(data, nr_points=1000, method='lttb', t_key=None, key_parameters=None):
+    """
+    Downsamples a dict of equal length columns (e.g. ColumnDataSource.data) to at most nr_points rows.
+    :param key_parameters: columns used first when nr_points is too small for all numeric columns
+    :return: new dict
+    """
+    t = data.get(t_key) if t_key else None
+    columns = _numeric_columns(data, exclude=[t_key])
+    key_parameters = [key for key in key_parameters or [] if key in columns]
+    columns = key_parameters + [key for key in columns if key not in key_parameters]
+    idx = get_indices([data[key] for key in columns], nr_points=nr_points, method=method, t=t)
+    return {key: np.asarray(values)[idx] for key, values in data.items()}
+
+
+def get_flag_buttons(plot):
+    """ Returns the buttons of the single profile flag widgets of a ctdvis QCWorkTool. """
+    from bokeh.models import Button
+    return [child for widget in plot.flag_widgets.values() for child in getattr(widget, 'children', [])
+            if isinstance(child, Button)]
+
+
+def downsample_qc_tool(plot, nr_points=1000, method='lttb', y_key='y', key_parameters=None):
+    """
+    Downsamples the sources of a ctdvis QCWorkTool (after plot_stations and plot_data but before the layout is
+    served). The full resolution data of a profile is sent to the browser when the profile is selected.
+    The ctdvis flag buttons set flags on the rows given by the selected positions in the main source. The buttons are
+    therefore disabled while a downsampled profile is shown and enabled when its full resolution data is in the main
+    source.
+    :param plot: ctdvis.tools.quality_control.QCWorkTool
+    :param nr_points: points per profile
+    :param method: 'lttb' or 'minmax'
+    :param y_key: name of the pressure/depth column in the profile sources
+    :param key_parameters: columns used first when nr_points is too small for all parameters
+    :return: dict with full resolution data per profile key
+    """
+    from bokeh.models import CustomJS
+
+    full_data = {}
+    downsampled_sources = {}
+    main_source = plot.data_source['main_source']
+    flag_buttons = get_flag_buttons(plot)
+    for key, source in plot.data_source.items():
+        if key in ['main_source', 'default_source']:
+            continue
+        data = {col: np.asarray(values) for col, values in source.data.items()}
+        if not data or len(next(iter(data.values()))) <= nr_points:
+            continue
+        full_data[key] = data
+        downsampled_sources[key] = source
+        source.data = downsample_data(data, nr_points=nr_points, method=method, t_key=y_key,
+                                      key_parameters=key_parameters)
+        source.tags = [DOWNSAMPLED_TAG]
+        # When the full data arrives the main source is pointed to it again (as in the ctdvis station callback).
+        # Points selected in the downsampled profile are deselected, their indices do not match the full data.
+        source.js_on_change('data', CustomJS(args={'source': source,
+                                                   'main_source': main_source,
+                                                   'position_source': plot.position_plot_source,
+                                                   'flag_buttons': flag_buttons,
+                                                   'key': key},
+                                             code="""
+            source.tags = [];
+            var selected = position_source.selected.indices;
+            if (selected.length == 1 && position_source.data['KEY'][selected[0]] == key) {
+                main_source.data = source.data;
+                main_source.selected.indices = [];
+                main_source.change.emit();
+                for (var i = 0; i < flag_buttons.length; i++) {
+                    flag_buttons[i].disabled = false;
+                }
+            }
+            """))
+
+    if downsampled_sources:
+        plot.position_plot_source.selected.js_on_change('indices', CustomJS(
+            args={'sources': downsampled_sources,
+                  'position_source': plot.position_plot_source,
+                  'flag_buttons': flag_buttons,
+                  'tag': DOWNSAMPLED_TAG},
+            code="""
+            var selected = position_source.selected.indices;
+            var downsampled = false;
+            for (var i = 0; i < selected.length; i++) {
+                var source = sources[position_source.data['KEY'][selected[i]]];
+                if (source && source.tags.includes(tag)) {
+                    downsampled = true;
+                }
+            }
+            for (var i = 0; i < flag_buttons.length; i++) {
+                flag_buttons[i].disabled = downsampled;
+            }
+            """))
+
+    ts_data = {col: np.asarray(values) for col, values in plot.ts_source.data.items()}
+    if ts_data.get('KEY') is not None and len(ts_data['KEY']):
+        keep = []
+        for key in np.unique(ts_data['KEY']):
+            positions = np.flatnonzero(ts_data['KEY'] == key)
+            idx = get_indices([ts_data['x'][positions], ts_data['y'][positions]], nr_points=nr_points, method=method)
+            keep.append(positions[idx])
+        keep = np.sort(np.concatenate(keep))
+        plot.ts_source.data = {col: values[keep] for col, values in ts_data.items()}
+
+    def load_full_resolution(attr, old, new):
+        if len(new) != 1:
+            return
+        key = plot.position_plot_source.data['KEY'][new[0]]
+        data = full_data.pop(key, None)
+        if data is not None:
+            plot.data_source[key].data = data
+
+    plot.position_plot_source.selected.on_change('indices', load_full_resolution)
+    return full_data
@@ -22,3 +22,10 @@ class PermissionError(SveaException):
 class MissingSharkModules(SveaException):
     pass
 
+
+class Cancelled(SveaException):
+    pass
+
+
+class InvalidFileFormat(SveaException):
+    pass
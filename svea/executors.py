@@ -0,0 +1,256 @@
+"""
+Executors used to run work units (one cast per unit) of the expensive stages.
+
+All executors follow the concurrent.futures.Executor interface (submit, map, shutdown). Work units must be picklable,
+i.e. module level functions with picklable arguments, to run in a process pool or on a TCP worker.
+
+A TCP job server is started in the process running SveaController. By default it only listens on localhost.
+Listening on other interfaces, so that workers on other machines (sharing the file system with the server) can
+connect, has to be turned on with allow_remote=True. Workers connect with:
+
+    python -m svea.executors --address <host>:<port> --authkey <key>
+
+Jobs and results are pickled. Only run workers against servers you trust and always use a secret authkey.
+"""
+import argparse
+import concurrent.futures
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import secrets
+import threading
+
+from svea import exceptions
+
+EXECUTORS = ['serial', 'thread', 'process', 'tcp']
+
+LOCAL_HOSTS = ['127.0.0.1', 'localhost', '::1']
+
+
+class SerialExecutor(concurrent.futures.Executor):
+    """ Runs each work unit directly in submit. Same interface as the other executors. """
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TCPJobServer(concurrent.futures.Executor):
+    """
+    Hands out submitted work units to workers that connect over TCP. Each connected worker runs one unit at a time.
+    Units given to a worker that disconnects before returning a result are handed to the next worker.
+    :param address: (host, port). Port 0 picks a free port.
+    :param authkey: Defaults to environment variable SVEA_AUTHKEY or a random key
+    :param allow_remote: Must be True to listen on other interfaces than localhost
+    """
+    def __init__(self, address=('127.0.0.1', 0), authkey=None, allow_remote=False, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        if address[0] not in LOCAL_HOSTS and not allow_remote:
+            raise exceptions.SveaException(f'TCP job server would listen on {address[0]}. Jobs are pickled and run '
+                                           f'by the workers, set allow_remote=True to accept remote workers.')
+        if authkey is None:
+            authkey = os.environ.get('SVEA_AUTHKEY') or secrets.token_hex(16)
+        if isinstance(authkey, str):
+            authkey = authkey.encode()
+        self.authkey = authkey
+        self._listener = multiprocessing.connection.Listener(tuple(address), authkey=self.authkey)
+        self._jobs = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._accept_thread = threading.Thread(target=self._accept_workers, daemon=True)
+        self._accept_thread.start()
+        self.logger.info(f'TCP job server listening on {self.address}')
+
+    @property
+    def address(self):
+        return self._listener.address
+
+    @property
+    def nr_workers(self):
+        with self._lock:
+            return len([thread for thread in self._workers if thread.is_alive()])
+
+    def submit(self, fn, *args, **kwargs):
+        if self._shutdown:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        future = concurrent.futures.Future()
+        self._jobs.put((future, fn, args, kwargs, False))
+        return future
+
+    def _accept_workers(self):
+        while not self._shutdown:
+            try:
+                connection = self._listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                if self._shutdown:
+                    return
+                self.logger.warning(f'Worker could not connect: {e}')
+                continue
+            thread = threading.Thread(target=self._serve_worker, args=(connection,), daemon=True)
+            with self._lock:
+                self._workers.append(thread)
+            thread.start()
+            self.logger.debug(f'Worker connected from {self._listener.last_accepted}')
+
+    def _serve_worker(self, connection):
+        with connection:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    try:
+                        connection.send(None)
+                    except OSError:
+                        pass
+                    return
+                future, fn, args, kwargs, started = job
+                if not started and not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    connection.send((fn, args, kwargs))
+                    ok, result = connection.recv()
+                except (OSError, EOFError) as e:
+                    self.logger.warning(f'Lost connection to worker ({e}). Job is handed to another worker.')
+                    self._jobs.put((future, fn, args, kwargs, True))
+                    return
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self._shutdown = True
+        if cancel_futures:
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job:
+                    job[0].cancel()
+        with self._lock:
+            workers = self._workers[:]
+        for _ in workers:
+            self._jobs.put(None)
+        self._listener.close()
+        if wait:
+            for thread in workers:
+                thread.join()
+
+
+def run_worker(address, authkey):
+    """
+    Connects to a TCP job server and runs work units until the server shuts down.
+    :param address: (host, port)
+    :param authkey: Same key as the server
+    :return:
+    """
+    if isinstance(authkey, str):
+        authkey = authkey.encode()
+    with multiprocessing.connection.Client(tuple(address), authkey=authkey) as connection:
+        while True:
+            try:
+                job = connection.recv()
+            except EOFError:
+                return
+            except Exception as e:
+                # E.g. the work unit can not be unpickled on this worker
+                connection.send((False, e))
+                continue
+            if job is None:
+                return
+            fn, args, kwargs = job
+            try:
+                result = (True, fn(*args, **kwargs))
+            except Exception as e:
+                result = (False, e)
+            connection.send(result)
+
+
+def start_local_workers(address, authkey, nr_workers=None):
+    """
+    Starts workers on this machine. Useful for testing the TCP job server on localhost.
+    :return: list of multiprocessing.Process
+    """
+    nr_workers = nr_workers or os.cpu_count()
+    processes = []
+    for _ in range(nr_workers):
+        process = multiprocessing.Process(target=run_worker, args=(address, authkey), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def iter_completed(executor, units, progress=None):
+    """
+    Submits work units and yields (key, future) as the units complete. Without executor (or with a SerialExecutor)
+    units are run one at a time. If progress (svea.progress.Progress) is cancelled, units that have not started are
+    cancelled and exceptions.Cancelled is raised. Units already running are left to finish.
+    :param executor:
+    :param units: dict like {key: (fn, args, kwargs)}
+    :param progress:
+    :return:
+    """
+    if executor is None or isinstance(executor, SerialExecutor):
+        serial_executor = SerialExecutor()
+        for key, (fn, args, kwargs) in units.items():
+            if progress:
+                progress.check()
+            yield key, serial_executor.submit(fn, *args, **kwargs)
+        return
+
+    futures = {executor.submit(fn, *args, **kwargs): key for key, (fn, args, kwargs) in units.items()}
+    pending = set(futures)
+    try:
+        while pending:
+            if progress and progress.cancelled:
+                break
+            done, pending = concurrent.futures.wait(pending, timeout=0.5,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield futures[future], future
+    finally:
+        for future in pending:
+            future.cancel()
+    if progress:
+        progress.check()
+
+
+def get_executor(name=None, max_workers=None, **kwargs):
+    """
+    :param name: 'serial', 'thread', 'process' or 'tcp'. None gives serial.
+    :param max_workers: for thread and process pools
+    :param kwargs: passed to TCPJobServer (address, authkey, allow_remote, logger)
+    :return:
+    """
+    if name in [None, 'serial']:
+        return SerialExecutor()
+    elif name == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    elif name == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    elif name == 'tcp':
+        return TCPJobServer(**kwargs)
+    raise exceptions.SveaException(f'Invalid executor "{name}". Valid executors are: {EXECUTORS}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Svea worker. Runs work units from a TCP job server.')
+    parser.add_argument('--address', required=True, help='host:port of the job server')
+    parser.add_argument('--authkey', default=os.environ.get('SVEA_AUTHKEY'),
+                        help='Secret shared with the job server. Defaults to environment variable SVEA_AUTHKEY')
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error('authkey is required')
+    host, port = args.address.rsplit(':', 1)
+    run_worker((host, int(port)), args.authkey)
+
+
+if __name__ == '__main__':
+    main()
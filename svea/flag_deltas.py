@@ -0,0 +1,228 @@
+"""
+Change log of manual qc flags (flag deltas).
+
+The visual qc server records manual flag changes in <data directory>/manual_qc_flags.jsonl, one line per
+profile, parameter and flag value:
+
+    {"time": "20240101120000", "file": "ctd_profile_...txt", "parameter": "Q_TEMP_CTD", "flag": "B", "rows": [[10, 25]]}
+
+rows are inclusive ranges of data row numbers. Replaying the log in order gives the manual flags.
+
+    - write_back rewrites only the files with changes that are not written yet.
+    - the automatic qc replays the whole log on the data (apply_entries) before the files are created again, see
+      AutomaticQC in svea.controller.
+
+FlagDeltaRecorder only depends on numpy and pandas since it is copied to and used by the bokeh server file (see
+VisualQC.set_options). The other functions are used by svea.
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+LOG_FILE_NAME = 'manual_qc_flags.jsonl'
+QC_PREFIXES = ('Q_', 'Q0_')
+
+
+def get_log_path(directory):
+    return Path(directory, LOG_FILE_NAME)
+
+
+def get_ranges(rows):
+    """ [1, 2, 3, 7] -> [[1, 3], [7, 7]] """
+    rows = np.asarray(sorted(rows), dtype=int)
+    if not len(rows):
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]]))
+    return [[int(start), int(end)] for start, end in zip(starts, ends)]
+
+
+def get_rows(ranges):
+    if not ranges:
+        return np.array([], dtype=int)
+    return np.concatenate([np.arange(start, end + 1) for start, end in ranges])
+
+
+class FlagDeltaLog:
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+        self.state_file_path = Path(f'{self.file_path}.state')
+
+    def __repr__(self):
+        return f'FlagDeltaLog({self.file_path})'
+
+    def append(self, entries):
+        if not entries:
+            return
+        if not self.file_path.parent.exists():
+            os.makedirs(self.file_path.parent)
+        with open(self.file_path, 'a', encoding='utf-8') as fid:
+            for entry in entries:
+                fid.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            fid.flush()
+            os.fsync(fid.fileno())
+
+    def read(self, start=0):
+        """ Returns the entries from line number start. Incomplete lines (e.g. from an interrupted write) are skipped. """
+        if not self.file_path.exists():
+            return []
+        entries = []
+        with open(self.file_path, encoding='utf-8') as fid:
+            for nr, line in enumerate(fid):
+                if nr < start:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    def get_nr_lines(self):
+        if not self.file_path.exists():
+            return 0
+        with open(self.file_path, encoding='utf-8') as fid:
+            return sum(1 for _ in fid)
+
+    @property
+    def written_lines(self):
+        """ Number of log lines already written to the files. """
+        if not self.state_file_path.exists():
+            return 0
+        with open(self.state_file_path) as fid:
+            return json.load(fid).get('written_lines', 0)
+
+    @written_lines.setter
+    def written_lines(self, nr_lines):
+        temp_path = Path(f'{self.state_file_path}.tmp')
+        with open(temp_path, 'w') as fid:
+            json.dump({'written_lines': nr_lines}, fid)
+        os.replace(temp_path, self.state_file_path)
+
+    def get_entries_by_file(self, entries=None):
+        entries = self.read() if entries is None else entries
+        by_file = {}
+        for entry in entries:
+            by_file.setdefault(entry['file'], []).append(entry)
+        return by_file
+
+
+def apply_entries(df, entries):
+    """
+    Replays entries on a DataFrame with the data of one profile.
+    :return: number of changed values
+    """
+    nr_changed = 0
+    for entry in entries:
+        parameter = entry['parameter']
+        if parameter not in df.columns:
+            continue
+        rows = get_rows(entry['rows'])
+        rows = rows[rows < len(df)]
+        column = df.columns.get_loc(parameter)
+        nr_changed += int((df.iloc[rows, column] != entry['flag']).sum())
+        df.iloc[rows, column] = entry['flag']
+    return nr_changed
+
+
+class FlagDeltaRecorder:
+    """
+    Records changes of qc flag columns in datasets (as used by ctdvis: {file_name: {'data': DataFrame, ...}}).
+    ctdvis sets flags in place in datasets. Call record(file_names) with the profiles that may have changed after
+    flags are set, e.g. the selected profiles, and record() to check all profiles.
+    """
+    def __init__(self, datasets, log_path):
+        self.datasets = datasets
+        self.log = FlagDeltaLog(log_path)
+        self._snapshots = {}
+        for file_name, item in datasets.items():
+            df = item['data']
+            columns = [col for col in df.columns if str(col).startswith(QC_PREFIXES)]
+            self._snapshots[file_name] = df[columns].copy()
+
+    def record(self, file_names=None):
+        """
+        Appends the changes since the last call to the log.
+        :param file_names: only check these files (all if None)
+        :return: number of log entries added
+        """
+        entries = []
+        time_stamp = time.strftime('%Y%m%d%H%M%S')
+        if file_names is None:
+            file_names = list(self._snapshots)
+        for file_name in file_names:
+            snapshot = self._snapshots.get(file_name)
+            if snapshot is None:
+                continue
+            current = self.datasets[file_name]['data'][list(snapshot.columns)]
+            changed = current.ne(snapshot) & ~(current.isna() & snapshot.isna())
+            if not changed.values.any():
+                continue
+            for parameter in snapshot.columns[changed.any().values]:
+                rows = np.flatnonzero(changed[parameter].values)
+                values = current[parameter].values[rows]
+                for flag in np.unique(values.astype(str)):
+                    entries.append({'time': time_stamp,
+                                    'file': file_name,
+                                    'parameter': parameter,
+                                    'flag': flag,
+                                    'rows': get_ranges(rows[values.astype(str) == flag])})
+            self._snapshots[file_name] = current.copy()
+        self.log.append(entries)
+        return len(entries)
+
+
+def rewrite_file(file_path, entries):
+    """
+    Applies entries to a standard format file and rewrites it if anything changed. The file is replaced (not
+    modified in place) so that hard links to other files are not affected.
+    :return: True if the file was rewritten
+    """
+    from svea import stdfmt_reader, stdfmt_writer
+
+    with stdfmt_reader.StandardFormatFile(file_path) as fid:
+        df = fid.get_data()
+        metadata_lines = fid.metadata_lines
+    if not apply_entries(df, entries):
+        return False
+    lines = list(metadata_lines) + list(stdfmt_writer.get_data_lines(df))
+    temp_path = Path(file_path.parent, f'.{file_path.name}.tmp')
+    stdfmt_writer.write_lines(lines, temp_path)
+    os.replace(temp_path, file_path)
+    return True
+
+
+def write_back(directory, logger=None):
+    """
+    Rewrites the files in directory that have log entries not written yet.
+    :return: list of rewritten files
+    """
+    log = FlagDeltaLog(get_log_path(directory))
+    nr_lines = log.get_nr_lines()
+    written_lines = log.written_lines
+    if nr_lines <= written_lines:
+        return []
+    new_entries = log.read(start=written_lines)
+    affected_files = {entry['file'] for entry in new_entries}
+    by_file = log.get_entries_by_file()
+    rewritten = _rewrite_files(directory, {name: by_file[name] for name in affected_files}, logger=logger)
+    log.written_lines = nr_lines
+    return rewritten
+
+
+def _rewrite_files(directory, entries_by_file, logger=None):
+    rewritten = []
+    for file_name, entries in entries_by_file.items():
+        file_path = Path(directory, file_name)
+        if not file_path.exists():
+            if logger:
+                logger.warning(f'Manual qc flags recorded for missing file: {file_path}')
+            continue
+        if rewrite_file(file_path, entries):
+            rewritten.append(file_path)
+    if logger:
+        logger.info(f'Manual qc flags written to {len(rewritten)} files in {directory}')
+    return rewritten
@@ -0,0 +1,141 @@
+"""
+Metadata workbook (ctd_metadata.xlsx) built in memory and written once.
+
+The ctdpy metadata_template writer saves the template to a temporary workbook that is later copied and reopened to
+add sensor info. Here the template sheets, sensor info and other single cells are put together in memory and
+written in one pass with openpyxl write-only mode. The result is compared with the ctdpy output in
+tests/test_metadata_workbook.py.
+"""
+import logging
+import time
+
+import openpyxl
+
+WRITER = 'metadata_template'
+TEMPLATE = 'ctd_metadata'
+
+
+def get_sheet_layout(session):
+    """
+    Returns [(sheet_name, header, start_row), ...] in sheet order, the same way as the ctdpy MetadataWriter.
+    :param session: ctdpy_session.Session
+    """
+    template_settings = session.settings.templates[TEMPLATE]['template']
+    return [(sheet_name, header_row is not None, header_row if header_row is not None else 0)
+            for sheet_name, header_row in zip(template_settings['sheet_name'], template_settings['header_row'])]
+
+
+def get_file_name(session):
+    """ File name used by the ctdpy metadata_template writer, e.g. ctd_metadata.xlsx """
+    writer_settings = session.settings.writers[WRITER]['writer']
+    return writer_settings.get('filename') + writer_settings.get('extension_filename')
+
+
+def get_cell_value(value):
+    """ Returns a value that openpyxl can write. Missing values gives empty cells. """
+    if value is None:
+        return None
+    try:
+        if value != value:  # nan
+            return None
+    except (TypeError, ValueError):
+        pass
+    if hasattr(value, 'item'):  # numpy scalar
+        return value.item()
+    return value
+
+
+class MetadataWorkbook:
+    """
+    Builds the metadata workbook in memory and writes it once to its final path using openpyxl write-only mode.
+    Sheets are added as dataframes and single cells (e.g. sensor info) are added as {coordinate: value}.
+    """
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.sheet_names = []
+        self._frames = {}
+        self._cells = {}
+
+    def add_sheet(self, sheet_name, df=None, header=True, start_row=0):
+        """
+        :param sheet_name:
+        :param df: pandas.DataFrame written from start_row (0-based, same as pandas.to_excel(startrow=...))
+        :param header: Write column names above data
+        :param start_row:
+        :return:
+        """
+        if sheet_name not in self.sheet_names:
+            self.sheet_names.append(sheet_name)
+        self._frames[sheet_name] = dict(df=df, header=header, start_row=start_row or 0)
+
+    def add_cells(self, sheet_name, data):
+        """
+        Values in data overrides values from the dataframe of the sheet.
+        :param sheet_name:
+        :param data: dict like {'B3': 'value'}
+        :return:
+        """
+        if not data:
+            return
+        if sheet_name not in self.sheet_names:
+            self.sheet_names.append(sheet_name)
+        self._cells.setdefault(sheet_name, {}).update(data)
+
+    def add_from_ctdpy_session(self, session, dataset):
+        """
+        Does what the ctdpy metadata_template writer (MetadataWriter.write) does but keeps the template in memory.
+        ctdpy writes each template sheet with pandas.to_excel(header=<header_row is not None>,
+        startrow=<header_row or 0>) to a new workbook, so the same sheets, header positions and values are written
+        here. As with ctdpy, nothing but the template dataframes is taken from the template workbook.
+        :param session: ctdpy_session.Session
+        :param dataset: dataset with cnv data (datasets[0])
+        :return:
+        """
+        writer = session.load_writer(WRITER)
+        for fid, item in dataset.items():
+            item['metadata']['FILE_NAME'] = fid
+            writer.append_to_template(item['metadata'])
+        writer.convert_formats()
+        writer.template_handler.template['Metadata'].sort(sort_by_keys=['SHIPC', 'SDATE', 'STIME'])
+
+        for sheet_name, header, start_row in get_sheet_layout(session):
+            self.add_sheet(sheet_name,
+                           df=writer.template_handler.template[sheet_name],
+                           header=header,
+                           start_row=start_row)
+
+    def _get_rows(self, sheet_name):
+        rows = {}
+        frame = self._frames.get(sheet_name)
+        if frame and frame['df'] is not None:
+            df = frame['df']
+            r = frame['start_row']
+            if frame['header']:
+                rows[r] = [str(col) for col in df.columns]
+                r += 1
+            for values in df.itertuples(index=False, name=None):
+                rows[r] = [get_cell_value(value) for value in values]
+                r += 1
+
+        for coordinate, value in self._cells.get(sheet_name, {}).items():
+            column_letter, row_nr = openpyxl.utils.cell.coordinate_from_string(coordinate)
+            r = row_nr - 1
+            c = openpyxl.utils.cell.column_index_from_string(column_letter) - 1
+            row = rows.setdefault(r, [])
+            if len(row) <= c:
+                row.extend([None] * (c + 1 - len(row)))
+            row[c] = value
+        return rows
+
+    def save(self, file_path):
+        start_time = time.time()
+        wb = openpyxl.Workbook(write_only=True)
+        for sheet_name in self.sheet_names:
+            ws = wb.create_sheet(title=sheet_name)
+            rows = self._get_rows(sheet_name)
+            if not rows:
+                continue
+            for r in range(max(rows) + 1):
+                ws.append(rows.get(r, []))
+        wb.save(file_path)
+        self.logger.debug(f'Metadata workbook written in {time.time() - start_time} seconds at location {file_path}')
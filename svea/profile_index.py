@@ -0,0 +1,263 @@
+"""
+Spatio-temporal index of standard format files (ctd_profile_*.txt) across cruises.
+
+One row per file with time, position, ship, series number and station, kept in a sqlite database so that one index
+can be shared by many working directories. Values are taken from the metadata lines (//METADATA;KEY;VALUE), the
+first data row and the file name (ctd_profile_<SDATE>_<SHIPC>_<SERNO>.txt), in that order. Only the header and the
+first data line of each file are read.
+
+Files are identified by their path. On update, files with unchanged size and modification time are skipped and
+files removed from an indexed directory are removed from the index.
+
+    index = ProfileIndex(path)
+    index.update_directory(directory)
+    df = index.query(lat_range=(56, 58), lon_range=(10, 13), time_range=('2021-01-01', '2021-03-01'), ships=['77SE'])
+"""
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from svea import exceptions
+from svea import stdfmt_reader
+
+FILE_PATTERN = 'ctd_profile*.txt'
+FILE_NAME_ELEMENTS = ['SMTYP', 'DTYPE', 'SDATE', 'SHIPC', 'SERNO']
+
+LATITUDE_KEYS = ['LATITUDE_DD', 'LATIT_DD']
+LONGITUDE_KEYS = ['LONGITUDE_DD', 'LONGI_DD']
+SHIP_KEYS = ['SHIPC']
+SERNO_KEYS = ['SERNO']
+STATION_KEYS = ['STATN', 'STATION', 'STATION_NAME']
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+COLUMNS = ['path', 'file_name', 'directory', 'time', 'lat', 'lon', 'ship', 'serno', 'station', 'size', 'mtime_ns']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    path TEXT PRIMARY KEY,
+    file_name TEXT,
+    directory TEXT,
+    time TEXT,
+    lat REAL,
+    lon REAL,
+    ship TEXT,
+    serno TEXT,
+    station TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS profiles_time ON profiles (time);
+CREATE INDEX IF NOT EXISTS profiles_position ON profiles (lat, lon);
+CREATE INDEX IF NOT EXISTS profiles_ship ON profiles (ship, serno);
+CREATE INDEX IF NOT EXISTS profiles_directory ON profiles (directory);
+"""
+
+
+def _first_value(info, keys):
+    for key in keys:
+        value = info.get(key)
+        if value not in [None, '']:
+            return value
+    return None
+
+
+def _to_float(value):
+    if value in [None, '']:
+        return None
+    try:
+        return float(str(value).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _format_time(value):
+    """ Converts str, datetime or pd.Timestamp to the format stored in the index. """
+    if value is None:
+        return None
+    return pd.Timestamp(value).strftime(TIME_FORMAT)
+
+
+def _get_time(info):
+    if all(info.get(key) not in [None, ''] for key in ['YEAR', 'MONTH', 'DAY']):
+        try:
+            return pd.Timestamp(year=int(info['YEAR']), month=int(info['MONTH']), day=int(info['DAY']),
+                                hour=int(info.get('HOUR') or 0), minute=int(info.get('MINUTE') or 0)).strftime(TIME_FORMAT)
+        except ValueError:
+            pass
+    sdate = info.get('SDATE')
+    if not sdate:
+        return None
+    try:
+        return _format_time(f'{sdate} {info.get("STIME") or ""}'.strip())
+    except ValueError:
+        return None
+
+
+def get_file_info(file_path, encoding=None):
+    """
+    Reads time, position, ship, series number and station of one standard format file.
+    :return: dict with the keys in COLUMNS
+    """
+    file_path = Path(file_path).absolute()
+    info = dict(zip(FILE_NAME_ELEMENTS, file_path.stem.split('_')))
+    with stdfmt_reader.StandardFormatFile(file_path, encoding=encoding) as fid:
+        info.update({key: value for key, value in fid.get_first_row().items() if value != ''})
+        for line in fid.metadata_lines:
+            parts = line.split(';')
+            if parts[0] == '//METADATA' and len(parts) >= 3 and parts[2].strip():
+                info[parts[1]] = parts[2].strip()
+    st = os.stat(file_path)
+    return {'path': str(file_path),
+            'file_name': file_path.name,
+            'directory': str(file_path.parent),
+            'time': _get_time(info),
+            'lat': _to_float(_first_value(info, LATITUDE_KEYS)),
+            'lon': _to_float(_first_value(info, LONGITUDE_KEYS)),
+            'ship': _first_value(info, SHIP_KEYS),
+            'serno': _first_value(info, SERNO_KEYS),
+            'station': _first_value(info, STATION_KEYS),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns}
+
+
+class ProfileIndex:
+    def __init__(self, file_path, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.file_path = Path(file_path)
+        if not self.file_path.parent.exists():
+            os.makedirs(self.file_path.parent)
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    def __repr__(self):
+        return f'ProfileIndex({self.file_path}, nr_profiles={len(self)})'
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM profiles').fetchone()[0]
+
+    def _connect(self):
+        # One connection per call so that the index can be used from several threads
+        return _Connection(self.file_path)
+
+    def update(self, file_paths):
+        """
+        Adds or updates files. Files with unchanged size and modification time are skipped.
+        :return: number of added or updated files
+        """
+        file_paths = [Path(path).absolute() for path in file_paths]
+        if not file_paths:
+            return 0
+        with self._connect() as connection:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                     connection.execute('SELECT path, size, mtime_ns FROM profiles')}
+            rows = []
+            for path in file_paths:
+                st = os.stat(path)
+                if known.get(str(path)) == (st.st_size, st.st_mtime_ns):
+                    continue
+                try:
+                    info = get_file_info(path)
+                except exceptions.InvalidFileFormat as e:
+                    self.logger.warning(f'Not added to profile index: {e}')
+                    continue
+                rows.append(tuple(info[col] for col in COLUMNS))
+            connection.executemany(f'INSERT OR REPLACE INTO profiles ({", ".join(COLUMNS)}) '
+                                   f'VALUES ({", ".join("?" * len(COLUMNS))})', rows)
+        return len(rows)
+
+    def update_directory(self, directory, pattern=FILE_PATTERN):
+        """
+        Indexes the standard format files in directory and removes files no longer in the directory.
+        :return: dict like {'updated': nr files, 'removed': nr files}
+        """
+        directory = Path(directory).absolute()
+        if not directory.exists():
+            raise exceptions.PathError(f'Directory not found: {directory}')
+        file_paths = sorted(directory.glob(pattern))
+        updated = self.update(file_paths)
+        existing = {str(path) for path in file_paths}
+        with self._connect() as connection:
+            indexed = [row[0] for row in connection.execute('SELECT path FROM profiles WHERE directory = ?',
+                                                            (str(directory), ))]
+            removed = [(path, ) for path in indexed if path not in existing]
+            connection.executemany('DELETE FROM profiles WHERE path = ?', removed)
+        self.logger.info(f'Profile index updated for {directory}: {updated} files added or updated, '
+                         f'{len(removed)} removed')
+        return {'updated': updated, 'removed': len(removed)}
+
+    def remove(self, file_paths=None, directory=None):
+        """ Removes files and/or all files in directory from the index. """
+        with self._connect() as connection:
+            if file_paths:
+                connection.executemany('DELETE FROM profiles WHERE path = ?',
+                                       [(str(Path(path).absolute()), ) for path in file_paths])
+            if directory:
+                connection.execute('DELETE FROM profiles WHERE directory = ?', (str(Path(directory).absolute()), ))
+
+    def query(self, lat_range=None, lon_range=None, time_range=None, ships=None, serno_range=None, stations=None,
+              directories=None, limit=None):
+        """
+        Returns the profiles matching all given criteria, sorted by time.
+        :param lat_range: (min, max) in decimal degrees
+        :param lon_range: (min, max) in decimal degrees
+        :param time_range: (start, end), str/datetime/pd.Timestamp. None for an open end.
+        :param ships: list of ship codes, e.g. ['77SE']
+        :param serno_range: (min, max) as str or int, e.g. ('0001', '0050')
+        :param stations: list of station names
+        :param directories: list of directories
+        :param limit: max number of profiles
+        :return: pd.DataFrame with columns COLUMNS
+        """
+        conditions = []
+        args = []
+        for column, value_range, convert in [('lat', lat_range, float),
+                                             ('lon', lon_range, float),
+                                             ('time', time_range, _format_time),
+                                             ('serno', serno_range, lambda value: str(value).zfill(4))]:
+            if not value_range:
+                continue
+            start, end = value_range
+            if start is not None:
+                conditions.append(f'{column} >= ?')
+                args.append(convert(start))
+            if end is not None:
+                conditions.append(f'{column} <= ?')
+                args.append(convert(end))
+        for column, values in [('ship', ships),
+                               ('station', stations),
+                               ('directory', [str(Path(path).absolute()) for path in directories or []])]:
+            if not values:
+                continue
+            conditions.append(f'{column} IN ({", ".join("?" * len(values))})')
+            args.extend(values)
+        sql = f'SELECT {", ".join(COLUMNS)} FROM profiles'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY time'
+        if limit:
+            sql += ' LIMIT ?'
+            args.append(int(limit))
+        with self._connect() as connection:
+            rows = connection.execute(sql, args).fetchall()
+        return pd.DataFrame(rows, columns=COLUMNS)
+
+
+class _Connection:
+    """ sqlite connection that commits and closes on exit. """
+    def __init__(self, file_path):
+        self.connection = sqlite3.connect(str(file_path), timeout=30)
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, *args):
+        try:
+            if exc_type is None:
+                self.connection.commit()
+        finally:
+            self.connection.close()
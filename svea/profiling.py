@@ -0,0 +1,156 @@
+"""
+Per stage profiling of SveaController.
+
+When enabled, each stage gets a cProfile profile (<stage>.pstats) and a sampled stack profile in collapsed format
+(<stage>.collapsed) that can be rendered by flamegraph tools, e.g.:
+
+    flamegraph.pl create_standard_format.collapsed > create_standard_format.svg
+    speedscope create_standard_format.collapsed
+
+Work units run by executors in other processes (or on other machines) are profiled separately and saved in
+<stage>_workers/. They are merged into <stage>_workers.pstats and added to <stage>.collapsed under a "worker" root.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from svea import executors
+
+
+class StackSampler:
+    """ Samples the stacks of all threads (except its own) at a fixed interval. """
+    def __init__(self, interval=0.005, root=None):
+        self.interval = interval
+        self.root = root
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        thread_names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id not in thread_names:
+                    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                if self.root:
+                    stack.append(self.root)
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def write(self, file_path, mode='w'):
+        with open(file_path, mode) as fid:
+            for stack, count in self.counts.items():
+                fid.write(f'{stack} {count}\n')
+
+
+class StageProfiler:
+    """ Creates one output directory per run and profiles stages within it. """
+    def __init__(self, directory, interval=0.005, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.interval = interval
+        self.directory = Path(directory, time.strftime('%Y%m%d_%H%M%S'))
+        if not self.directory.exists():
+            os.makedirs(self.directory)
+
+    @contextlib.contextmanager
+    def profile(self, stage):
+        profile = cProfile.Profile()
+        sampler = StackSampler(interval=self.interval)
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            profile.dump_stats(str(Path(self.directory, f'{stage}.pstats')))
+            sampler.write(Path(self.directory, f'{stage}.collapsed'))
+            self._merge_worker_profiles(stage)
+            self.logger.info(f'Profile for {stage} saved in {self.directory}')
+
+    def get_worker_directory(self, stage):
+        return Path(self.directory, f'{stage}_workers')
+
+    def wrap_units(self, stage, units, executor):
+        """
+        Wraps work units so that they are profiled where they run.
+        :param stage:
+        :param units: dict like {key: (fn, args, kwargs)}
+        :param executor:
+        :return: units to submit instead
+        """
+        if executor is None or isinstance(executor, executors.SerialExecutor):
+            # Runs in this thread and is covered by the stage profile
+            return units
+        # Threads are sampled by the stage sampler
+        sample = not isinstance(executor, concurrent.futures.ThreadPoolExecutor)
+        directory = str(self.get_worker_directory(stage))
+        return {key: (run_profiled, (fn, directory, sample, self.interval) + tuple(args), kwargs)
+                for key, (fn, args, kwargs) in units.items()}
+
+    def _merge_worker_profiles(self, stage):
+        directory = self.get_worker_directory(stage)
+        if not directory.exists():
+            return
+        pstats_paths = [str(path) for path in directory.glob('*.pstats')]
+        if pstats_paths:
+            stats = pstats.Stats(*pstats_paths)
+            stats.dump_stats(str(Path(self.directory, f'{stage}_workers.pstats')))
+        with open(Path(self.directory, f'{stage}.collapsed'), 'a') as out_fid:
+            for path in directory.glob('*.collapsed'):
+                with open(path) as fid:
+                    out_fid.write(fid.read())
+
+
+def run_profiled(fn, directory, sample, interval, *args, **kwargs):
+    """
+    Runs a work unit under cProfile (and stack sampling if sample is True) and saves the result in directory.
+    Module level function so that it can be submitted to process pools and TCP workers.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f'{os.getpid()}_{uuid.uuid4().hex[:8]}'
+    profile = cProfile.Profile()
+    sampler = StackSampler(interval=interval, root=f'worker {os.getpid()}') if sample else None
+    if sampler:
+        sampler.start()
+    try:
+        profile.enable()
+    except ValueError:
+        # Another profiler is already active in this process
+        profile = None
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(str(Path(directory, f'{name}.pstats')))
+        if sampler:
+            sampler.stop()
+            sampler.write(Path(directory, f'{name}.collapsed'))
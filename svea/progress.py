@@ -0,0 +1,69 @@
+import logging
+import threading
+
+from svea import exceptions
+
+
+class CancellationToken:
+    """
+    Shared between the caller (e.g. a GUI) and a running stage. The stage stops cleanly between casts when the token
+    is cancelled and raises exceptions.Cancelled.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise exceptions.Cancelled('Cancelled by user')
+
+
+class Progress:
+    """
+    Reports progress per unit (cast/file) of a stage and checks for cancellation between units.
+    callback is called as callback(stage, name, nr_done, nr_total). name is None when the stage starts.
+    """
+    def __init__(self, callback=None, cancel_token=None, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.callback = callback
+        self.cancel_token = cancel_token
+        self.stage = None
+        self.nr_done = 0
+        self.nr_total = 0
+
+    @property
+    def active(self):
+        return bool(self.callback or self.cancel_token)
+
+    @property
+    def cancelled(self):
+        return bool(self.cancel_token and self.cancel_token.cancelled)
+
+    def start(self, stage, nr_total):
+        self.stage = stage
+        self.nr_done = 0
+        self.nr_total = nr_total
+        self.check()
+        self._report(None)
+
+    def update(self, name=None):
+        self.nr_done += 1
+        self._report(name)
+
+    def check(self):
+        if self.cancel_token:
+            self.cancel_token.raise_if_cancelled()
+
+    def _report(self, name):
+        if not self.callback:
+            return
+        try:
+            self.callback(self.stage, name, self.nr_done, self.nr_total)
+        except Exception as e:
+            self.logger.warning(f'Progress callback failed: {e}')
@@ -0,0 +1,264 @@
+"""
+Fast reading of standard format files (ctd_profile_*.txt).
+
+The ctd_stdfmt reader in ctdpy loads the whole file as a series of lines and splits the data lines in Python. Here
+the file is memory mapped, the metadata lines (starting with //) and the header line are located by scanning the
+mapped bytes and the data block is parsed by the C parser of pandas in one call.
+
+StandardFormatFile is lazy: only the metadata and the header are parsed when the object is created, after which the
+file is closed again. Parameters are parsed when requested (the file is then mapped again) and kept for later
+requests. Inside a with block the file is kept open between requests.
+
+    with StandardFormatFile(path) as fid:
+        print(fid.parameters)
+        df = fid.get_data(['PRES_CTD [dbar]', 'TEMP_CTD [deg C (ITS-90)]'])
+"""
+import contextlib
+import csv
+import locale
+import mmap
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from svea import exceptions
+
+METADATA_PREFIX = b'//'
+SEPARATOR = '\t'
+QC_PREFIXES = ('Q_', 'Q0_')
+
+
+def is_qc_column(name):
+    return name.startswith(QC_PREFIXES)
+
+
+class StandardFormatFile:
+    """
+    Memory mapped standard format file. The file is only open while it is read, or between open() and close().
+    :param file_path:
+    :param typed: If False all columns are strings, as from the ctdpy reader (needed by the automatic qc). If True
+                  numeric columns are parsed as floats while qc flag columns and text columns are kept as strings.
+    :param encoding: Defaults to the same encoding as used when the files are written
+    """
+    def __init__(self, file_path, typed=False, encoding=None):
+        self.file_path = Path(file_path)
+        self.typed = typed
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self._fid = None
+        self._mmap = None
+        self._stat = None
+        self._data_start = None
+        self._metadata_lines = None
+        self._parameters = None
+        self._columns = {}
+        with self._mapped() as mm:
+            self._read_header(mm)
+
+    def __repr__(self):
+        return f'StandardFormatFile({self.file_path}, nr_loaded_parameters={len(self._columns)})'
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def name(self):
+        return self.file_path.name
+
+    @property
+    def metadata_lines(self):
+        return self._metadata_lines
+
+    @property
+    def parameters(self):
+        return self._parameters
+
+    @property
+    def loaded_parameters(self):
+        return list(self._columns)
+
+    @property
+    def data(self):
+        """ All parameters. """
+        return self.get_data()
+
+    def open(self):
+        """ Keeps the file mapped until close() is called. """
+        if self._mmap is not None:
+            return
+        self._fid, self._mmap = self._map()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._fid.close()
+        self._mmap = None
+        self._fid = None
+
+    def _map(self):
+        st = os.stat(self.file_path)
+        if not st.st_size:
+            raise exceptions.InvalidFileFormat(f'Empty standard format file: {self.file_path}')
+        stat = (st.st_size, st.st_mtime_ns)
+        if self._stat is None:
+            self._stat = stat
+        elif stat != self._stat:
+            raise exceptions.SveaException(f'File has changed since it was opened: {self.file_path}')
+        fid = open(self.file_path, 'rb')
+        try:
+            return fid, mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            fid.close()
+            raise
+
+    @contextlib.contextmanager
+    def _mapped(self):
+        """ Yields the open map or maps the file for the duration of the block. """
+        if self._mmap is not None:
+            yield self._mmap
+            return
+        fid, mm = self._map()
+        try:
+            yield mm
+        finally:
+            mm.close()
+            fid.close()
+
+    def _read_header(self, mm):
+        metadata_lines = []
+        pos = 0
+        while mm[pos:pos + len(METADATA_PREFIX)] == METADATA_PREFIX:
+            end = mm.find(b'\n', pos)
+            if end == -1:
+                end = len(mm)
+            metadata_lines.append(mm[pos:end].decode(self.encoding).rstrip('\r'))
+            pos = end + 1
+        end = mm.find(b'\n', pos)
+        if end == -1:
+            raise exceptions.InvalidFileFormat(f'No data header found in standard format file: {self.file_path}')
+        parameters = mm[pos:end].decode(self.encoding).rstrip('\r').split(SEPARATOR)
+        if len(set(parameters)) != len(parameters):
+            raise exceptions.InvalidFileFormat(f'Duplicate parameters in standard format file: {self.file_path}')
+        self._metadata_lines = metadata_lines
+        self._parameters = parameters
+        self._data_start = end + 1
+
+    def get_first_row(self):
+        """ Returns the first data line as a dict {parameter: value} without parsing the data block. """
+        with self._mapped() as mm:
+            end = mm.find(b'\n', self._data_start)
+            if end == -1:
+                end = len(mm)
+            values = mm[self._data_start:end].decode(self.encoding).rstrip('\r').split(SEPARATOR)
+        if values == ['']:
+            return {}
+        return dict(zip(self._parameters, values))
+
+    def get_data(self, parameters=None):
+        """
+        Returns a DataFrame with the given parameters (all if None). Parameters not loaded before are parsed from
+        the file in one pass.
+        :param parameters: list of column names as in self.parameters
+        :return:
+        """
+        parameters = list(parameters or self._parameters)
+        missing = [par for par in parameters if par not in self._parameters]
+        if missing:
+            raise exceptions.SveaException(f'Parameters not in {self.name}: {missing}')
+        not_loaded = [par for par in parameters if par not in self._columns]
+        if not_loaded:
+            self._load(not_loaded)
+        return pd.DataFrame({par: self._columns[par] for par in parameters})
+
+    def _load(self, parameters):
+        kwargs = dict(sep=SEPARATOR,
+                      header=None,
+                      names=self._parameters,
+                      usecols=parameters,
+                      encoding=self.encoding,
+                      quoting=csv.QUOTE_NONE)
+        if self.typed:
+            kwargs.update(dtype={par: str for par in parameters if is_qc_column(par)},
+                          keep_default_na=False,
+                          na_values={par: [''] for par in parameters if not is_qc_column(par)})
+        else:
+            kwargs.update(dtype=str, na_filter=False)
+        with self._mapped() as mm:
+            mm.seek(self._data_start)
+            df = pd.read_csv(mm, **kwargs)
+        for par in parameters:
+            self._columns[par] = df[par]
+
+    def release(self, parameters=None):
+        """ Releases loaded parameters (all if None). """
+        if parameters is None:
+            self._columns = {}
+            return
+        for par in parameters:
+            self._columns.pop(par, None)
+
+
+def parse_metadata(lines, get_metadata=None, file_name=None):
+    """
+    Metadata of a standard format file the same way as the ctdpy ctd_stdfmt reader: the lines starting with // as a
+    pd.Series, parsed with get_metadata if given.
+    :param lines: metadata lines or all lines of the file
+    :param get_metadata: function(metadata_lines_as_series, filename=file_name), e.g. the get_metadata method of the
+                         ctdpy ctd_stdfmt reader
+    :param file_name:
+    :return:
+    """
+    metadata = []
+    for line in lines:
+        if not line.startswith('//'):
+            break
+        metadata.append(line)
+    metadata = pd.Series(metadata, dtype=object)
+    if get_metadata:
+        return get_metadata(metadata, filename=file_name)
+    return metadata
+
+
+def read_file(file_path, parameters=None, typed=False, encoding=None):
+    """
+    Reads one standard format file.
+    :return: dict like {'data': pd.DataFrame, 'metadata': list of metadata lines}
+    """
+    with StandardFormatFile(file_path, typed=typed, encoding=encoding) as fid:
+        return {'data': fid.get_data(parameters),
+                'metadata': fid.metadata_lines}
+
+
+def read_files(file_paths, parameters=None, typed=False, encoding=None, get_metadata=None):
+    """
+    Reads standard format files into the same structure as the ctdpy reader: {file_name: {'data': ..., 'metadata': ...}}
+    :param file_paths:
+    :param parameters: only these parameters are read (all if None)
+    :param typed: see StandardFormatFile
+    :param encoding:
+    :param get_metadata: function(metadata_lines_as_series, filename=file_name) to parse the metadata, e.g. the
+                         get_metadata method of the ctdpy ctd_stdfmt reader. Default keeps the lines as a pd.Series.
+    :return:
+    """
+    data = {}
+    for file_path in file_paths:
+        item = read_file(file_path, parameters=parameters, typed=typed, encoding=encoding)
+        file_name = Path(file_path).name
+        data[file_name] = {'data': item['data'],
+                           'metadata': parse_metadata(item['metadata'], get_metadata=get_metadata,
+                                                      file_name=file_name)}
+    return data
+
+
+def open_files(file_paths, typed=False, encoding=None):
+    """
+    Lazy mode: reads the metadata and header of the files without parsing any data. No files are kept open, data
+    is read from the files when requested.
+    :return: dict like {file_name: StandardFormatFile}
+    """
+    return {Path(file_path).name: StandardFormatFile(file_path, typed=typed, encoding=encoding)
+            for file_path in file_paths}
@@ -0,0 +1,158 @@
+"""
+Fast writing of the ctdpy ctd_standard_template (ctd_profile_*.txt files).
+
+The ctdpy writer builds each data line with a row wise DataFrame.apply and writes the lines with numpy.savetxt in a
+separate thread. Here the writer instance is patched so that whole columns are converted at once (one converter
+per column, chosen up front), lines are joined in one pass and written synchronously in large buffered blocks.
+The output is byte identical to the ctdpy writer, see compare_with_ctdpy_writer. Since private methods of the ctdpy
+writer are replaced, the fast writer is only used when asked for (SveaController.set_fast_writer).
+save_data writes synchronously with both writers, so the files are complete when it returns.
+"""
+import filecmp
+import os
+import tempfile
+import copy
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+WRITER = 'ctd_standard_template'
+
+# numpy.savetxt (used by ctdpy) opens the file in text mode with the default encoding and newline translation
+ENCODING = None
+NEWLINE = '\n'
+
+LINES_PER_BLOCK = 20000
+
+
+def _to_text(col):
+    # Missing values are written as empty strings, as after the fillna('') in StandardCTDWriter._get_data_columns
+    return col.astype(str).where(col.notna(), '').to_numpy(dtype=object)
+
+
+def get_column_converter(column):
+    """
+    Returns a function converting a whole column to an array of strings. Columns written by the standard format
+    writer are text columns and are used as is. Other columns (numbers, missing values, mixed types) are converted
+    with str and missing values become empty strings.
+    """
+    if column.dtype == object and pd.api.types.infer_dtype(column, skipna=False) in ['string', 'empty']:
+        return lambda col: col.to_numpy()
+    return _to_text
+
+
+def get_text_columns(df):
+    """ Returns the columns of df as arrays of strings, as they are written to file. """
+    columns = []
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        columns.append(get_column_converter(column)(column))
+    return columns
+
+
+def get_text_data(df):
+    """ Returns df with the values as they are written to file (same as when the file is read as text). """
+    return pd.DataFrame(dict(zip(df.columns, get_text_columns(df))))
+
+
+def get_data_lines(df, separator='\t'):
+    """
+    Same output as StandardCTDWriter._get_data_serie (ctdpy) but built column wise.
+    :param df: pandas.DataFrame with the data block of one profile
+    :param separator:
+    :return: pandas.Series with header line and data lines
+    """
+    columns = get_text_columns(df)
+    lines = [separator.join(df.columns)]
+    lines.extend(map(separator.join, zip(*columns)))
+    return pd.Series(lines)
+
+
+def write_lines(lines, save_path, lines_per_block=LINES_PER_BLOCK):
+    """
+    Writes lines the same way as numpy.savetxt(save_path, lines, fmt='%s') but in large blocks.
+    :param lines: iterable of lines (pandas.Series, list...)
+    :param save_path:
+    :param lines_per_block:
+    :return:
+    """
+    lines = [str(line) for line in lines]
+    with open(save_path, 'w', encoding=ENCODING, buffering=1024 * 1024) as fid:
+        for i in range(0, len(lines), lines_per_block):
+            fid.write(NEWLINE.join(lines[i:i + lines_per_block]) + NEWLINE)
+
+
+def patch_writer(writer):
+    """
+    Patches a ctdpy StandardCTDWriter instance to use the fast line builder and writer.
+    :param writer: instance from session.load_writer('ctd_standard_template')
+    :return: writer
+    """
+    def _get_data_serie(df, separator=None):
+        return get_data_lines(df, separator=separator)
+
+    def _write(fid, data_series, **kwargs):
+        write_lines(data_series, writer._get_save_path(fid, **kwargs))
+
+    writer._get_data_serie = _get_data_serie
+    writer._write = _write
+    return writer
+
+
+def write_with_numpy(data=None, save_path=None, fmt='%s'):
+    """ Same as TxtWriter.write_with_numpy (ctdpy) but synchronous, the ctdpy version writes in a separate thread. """
+    np.savetxt(save_path, data, fmt=fmt)
+
+
+def load_writer(session, fast=False):
+    """
+    Returns a ctd_standard_template writer that has written all files when write returns.
+    :param session: ctdpy session
+    :param fast: True to patch the writer with the fast line builder and writer, see patch_writer
+    :return: writer
+    """
+    writer = session.load_writer(WRITER)
+    writer.txt_writer.write_with_numpy = write_with_numpy
+    if fast:
+        patch_writer(writer)
+    return writer
+
+
+def save_data(session, datasets, save_path=None, fast=False):
+    """
+    Same as session.save_data(datasets, writer='ctd_standard_template', return_data_path=True, save_path=save_path)
+    but synchronous: all files are written when the function returns. Optionally with the fast writer.
+    :param session: ctdpy session
+    :param datasets:
+    :param save_path: export directory
+    :param fast: True to use the fast writer, False to use the ctdpy writer
+    :return: path to the directory with the written files
+    """
+    if save_path:
+        session.settings.update_export_path(save_path)
+    writer = load_writer(session, fast=fast)
+    writer.write(datasets)
+    return writer.data_path
+
+
+def compare_with_ctdpy_writer(session, datasets):
+    """
+    Writes datasets with both the ctdpy writer and the fast writer and compares the files byte by byte.
+    :return: list of file names that differ (empty list if all files are identical)
+    """
+    with tempfile.TemporaryDirectory() as temp_directory:
+        reference_directory = Path(temp_directory, 'ctdpy')
+        fast_directory = Path(temp_directory, 'fast')
+
+        reference_path = save_data(session, copy.deepcopy(datasets), save_path=str(reference_directory))
+
+        fast_path = save_data(session, copy.deepcopy(datasets), save_path=str(fast_directory), fast=True)
+
+        reference_names = sorted(os.listdir(reference_path))
+        fast_names = sorted(os.listdir(fast_path))
+        differ = sorted(set(reference_names) ^ set(fast_names))
+        for name in set(reference_names) & set(fast_names):
+            if not filecmp.cmp(Path(reference_path, name), Path(fast_path, name), shallow=False):
+                differ.append(name)
+        return differ
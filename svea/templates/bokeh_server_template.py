@@ -17,6 +17,7 @@ Open in web browser: http://localhost:5006/app_to_serve
 """
 from bokeh.plotting import curdoc
 from ctdvis.session import Session
+from ctdvis.tools.quality_control import QCWorkTool
 
 DATA_DIR = ''
 MONTH_LIST = []
@@ -26,10 +27,22 @@ SERNO_MAX = []
 
 VISUALIZE_SETTINGS = ''
 
+# Downsampling of the profiles sent to the browser: '' (no downsampling), 'lttb' or 'minmax'
+DOWNSAMPLING = ''
+DOWNSAMPLING_POINTS = 1000
+# Parameters that keep their shape first when DOWNSAMPLING_POINTS is too small for all parameters
+DOWNSAMPLING_KEY_PARAMETERS = []
+
+# Manual flag changes are recorded to this file (see svea.flag_deltas): '' (no recording)
+FLAG_LOG = ''
+
 URL = 'http://localhost:5006/'
 
 def bokeh_qc_tool():
-    """ Filters are advised to be implemented if the datasource is big, (~ >3 months of SMHI-EXP-data) """
+    """
+    Filters are advised to be implemented if the datasource is big, (~ >3 months of SMHI-EXP-data)
+    Returns the layout from s.run_tool, or the QCWorkTool if it is needed for downsampling or recording of flags.
+    """
     filters = {}
     if MONTH_LIST:
         filters['month_list'] = MONTH_LIST
@@ -46,11 +59,50 @@ def bokeh_qc_tool():
 
     s = Session(visualize_setting=visualize_setting, data_directory=DATA_DIR, filters=filters)
     s.setup_datahandler()
-    layout = s.run_tool(return_layout=True)
 
-    return layout
+    if not DOWNSAMPLING and not FLAG_LOG:
+        return s.run_tool(return_layout=True)
+
+    # Same as s.run_tool but the QCWorkTool is kept for downsampling and recording of manual flags
+    plot = QCWorkTool(
+        s.dh.df[s.settings.selected_keys],
+        datasets=s.dh.raw_data,
+        settings=s.settings,
+        ctdpy_session=s.dh.ctd_session,
+    )
+    plot.plot_stations()
+    plot.plot_data()
+    if DOWNSAMPLING:
+        from svea_downsampling import downsample_qc_tool
+        downsample_qc_tool(plot, nr_points=DOWNSAMPLING_POINTS, method=DOWNSAMPLING,
+                           key_parameters=DOWNSAMPLING_KEY_PARAMETERS)
+
+    return plot
 
 
-bokeh_layout = bokeh_qc_tool()
+qc_tool = bokeh_qc_tool()
 doc = curdoc()
-doc.add_root(bokeh_layout)
+if not isinstance(qc_tool, QCWorkTool):
+    doc.add_root(qc_tool)
+else:
+    doc.add_root(qc_tool.return_layout())
+
+if FLAG_LOG and isinstance(qc_tool, QCWorkTool):
+    from svea_flag_deltas import FlagDeltaRecorder
+    recorder = FlagDeltaRecorder(qc_tool.datasets, FLAG_LOG)
+    pending = []
+
+    def record_selected():
+        # The ctdvis flag buttons set flags in qc_tool.datasets for the selected profiles only
+        pending.clear()
+        position_source = qc_tool.position_plot_source
+        keys = [position_source.data['KEY'][i] for i in position_source.selected.indices]
+        recorder.record(file_names=[qc_tool.key_ds_mapper.get(key) for key in keys])
+
+    def on_document_change(event):
+        # Flags are set by python callbacks of the ctdvis flag buttons. Recording on the next tick runs after them.
+        if not pending:
+            pending.append(doc.add_next_tick_callback(record_selected))
+
+    doc.on_change(on_document_change)
+    doc.on_session_destroyed(lambda session_context: recorder.record())
@@ -0,0 +1,35 @@
+"""
+svea.compact with data as read by ctdpy (numbers stored as text).
+"""
+import numpy as np
+import pandas as pd
+
+from svea import compact
+
+
+def get_data():
+    return pd.DataFrame({'PRES_CTD [dbar]': ['0.992', '1.985', '2.977', '3.970'],
+                         'TEMP_CTD [deg C (ITS-90)]': ['10.4521', '', '10.3012', '-0.0001'],
+                         'Q_TEMP_CTD': ['', 'B', '', ''],
+                         'SERNO': ['0012', '0012', '0012', '0012']})
+
+
+def test_numbers_stored_as_text():
+    frame = compact.compact_frame(get_data())
+    assert frame['PRES_CTD [dbar]'].dtype == np.float32
+    assert frame['TEMP_CTD [deg C (ITS-90)]'].dtype == np.float32
+    assert np.isnan(frame['TEMP_CTD [deg C (ITS-90)]'].iloc[1])
+    assert isinstance(frame['Q_TEMP_CTD'].dtype, pd.CategoricalDtype)
+    # Leading zeros can not be recovered from a number
+    assert isinstance(frame['SERNO'].dtype, pd.CategoricalDtype)
+
+
+def test_text_is_recovered():
+    frame = compact.compact_frame(get_data())
+    text = [f'{value:.3f}' for value in frame['PRES_CTD [dbar]']]
+    assert text == get_data()['PRES_CTD [dbar]'].tolist()
+
+
+def test_numbers_not_recovered_are_kept_as_text():
+    for values in [['1.5', '1.50'], ['1e5', '2'], ['nan', '1'], ['+1', '2'], ['1.1234567', '2.1234567']]:
+        assert compact.get_numbers_from_text(pd.Series(values, dtype=object)) is None
@@ -0,0 +1,133 @@
+"""
+CreateStandardFormatFiles.create_files(keep_in_memory=True) end to end. The ctdpy session is replaced by a stand-in
+whose writer calls _write and the txt writer in the same order as StandardCTDWriter.write (profiles, delivery note,
+metadata, sensorinfo, information).
+"""
+import logging
+import os
+import types
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+controller = pytest.importorskip('svea.controller')
+
+CRUISE_FILE_NAMES = ['delivery_note.txt', 'information.txt', 'metadata.txt', 'sensorinfo.txt']
+PROFILE_LINES = ['//METADATA;a.cnv',
+                 'PRES_CTD [dbar]\tTEMP_CTD [deg C (ITS-90)]',
+                 '0.992\t10.4521',
+                 '1.985\t']
+
+
+class TxtWriter:
+    @staticmethod
+    def write_with_numpy(data=None, save_path=None, fmt='%s'):
+        np.savetxt(save_path, data, fmt=fmt)
+
+    @staticmethod
+    def write_with_pandas(data=None, save_path=None, header=False, sep='\t', encoding='cp1252'):
+        data.to_csv(save_path, sep=sep, encoding=encoding, index=False, header=header)
+
+
+class Writer:
+    def __init__(self, settings):
+        self.settings = settings
+        self.txt_writer = TxtWriter()
+
+    def _get_data_serie(self, df, separator=None):
+        lines = [separator.join(df.columns)]
+        lines.extend(df.apply(lambda x: separator.join(x), axis=1).to_list())
+        return pd.Series(lines)
+
+    def _get_save_path(self, fid, **kwargs):
+        if not hasattr(self, 'data_path'):
+            self.data_path = os.path.join(self.settings.export_path, 'ctd_std_fmt')
+            os.makedirs(self.data_path, exist_ok=True)
+        if Path(fid).suffix == '.cnv':
+            fid = f'ctd_profile_{Path(fid).stem}'
+        return os.path.join(self.data_path, f'{fid}.txt')
+
+    def _write(self, fid, data_series, **kwargs):
+        self.txt_writer.write_with_numpy(data=data_series, save_path=self._get_save_path(fid, **kwargs))
+
+    def write(self, datasets):
+        for fid, item in datasets[0].items():
+            data_series = self._get_data_serie(item['data'], separator='\t')
+            data_series = pd.concat([pd.Series([f'//METADATA;{Path(fid).name}']), data_series], ignore_index=True)
+            self._write(fid, data_series)
+        self._write('delivery_note', pd.Series(['MYEAR:2021']))
+        self.txt_writer.write_with_pandas(data=pd.DataFrame({'SERNO': ['0012']}),
+                                          save_path=self._get_save_path('metadata'), header=True)
+        self.txt_writer.write_with_pandas(data=pd.DataFrame({'INSTRUMENT_SERIE': ['0745']}),
+                                          save_path=self._get_save_path('sensorinfo'), header=True)
+        self._write('information', pd.Series(['Information']))
+
+
+def get_session_class(export_path):
+    class Session:
+        def __init__(self, filepaths=None, reader=None):
+            self.filepaths = filepaths
+            self.settings = types.SimpleNamespace(export_path=str(export_path))
+
+        def read(self):
+            data = {}
+            for path in self.filepaths:
+                if path.endswith('.cnv'):
+                    data[path] = {'data': pd.DataFrame({'PRES_CTD [dbar]': ['0.992', '1.985'],
+                                                        'TEMP_CTD [deg C (ITS-90)]': ['10.4521', '']}),
+                                  'metadata': {}}
+            return [data, {'metadata.xlsx': {}}]
+
+        def load_writer(self, writer):
+            return Writer(self.settings)
+
+    return Session
+
+
+def get_create_object(tmp_path, monkeypatch):
+    monkeypatch.setattr(controller.ctdpy_session, 'Session', get_session_class(tmp_path / 'export'))
+    cnv_directory = tmp_path / 'cnv'
+    cnv_directory.mkdir()
+    cnv_file_paths = []
+    for name in ['a.cnv', 'b.cnv']:
+        path = cnv_directory / name
+        path.write_text('cnv')
+        cnv_file_paths.append(path)
+    metadata_file_path = cnv_directory / 'metadata.xlsx'
+    metadata_file_path.write_text('metadata')
+
+    obj = controller.CreateStandardFormatFiles(logger=logging.getLogger(__name__))
+    obj.cnv_files_object = types.SimpleNamespace(file_paths=cnv_file_paths)
+    obj.metadata_file_object = types.SimpleNamespace(file_path=metadata_file_path)
+    obj.directory = tmp_path / 'standard_format'
+    obj.directory.mkdir()
+    return obj
+
+
+def test_keep_in_memory(tmp_path, monkeypatch):
+    obj = get_create_object(tmp_path, monkeypatch)
+    obj.create_files(keep_in_memory=True)
+    in_memory_files = obj.pop_in_memory_files()
+    obj.wait_for_written_files()
+
+    assert sorted(in_memory_files) == ['ctd_profile_a.txt', 'ctd_profile_b.txt']
+    item = in_memory_files['ctd_profile_a.txt']
+    assert item['data']['TEMP_CTD [deg C (ITS-90)]'].tolist() == ['10.4521', '']
+    assert item['metadata_lines'].tolist() == ['//METADATA;a.cnv']
+
+    assert sorted(os.listdir(obj.directory)) == ['ctd_profile_a.txt', 'ctd_profile_b.txt'] + CRUISE_FILE_NAMES
+    assert Path(obj.directory, 'ctd_profile_a.txt').read_text().splitlines() == PROFILE_LINES
+
+
+def test_keep_in_memory_with_fast_writer(tmp_path, monkeypatch):
+    obj = get_create_object(tmp_path, monkeypatch)
+    obj.fast_writer = True
+    obj.create_files(keep_in_memory=True)
+    in_memory_files = obj.pop_in_memory_files()
+    obj.wait_for_written_files()
+
+    assert sorted(in_memory_files) == ['ctd_profile_a.txt', 'ctd_profile_b.txt']
+    assert sorted(os.listdir(obj.directory)) == ['ctd_profile_a.txt', 'ctd_profile_b.txt'] + CRUISE_FILE_NAMES
+    assert Path(obj.directory, 'ctd_profile_a.txt').read_text().splitlines() == PROFILE_LINES
@@ -0,0 +1,118 @@
+"""
+MetadataWorkbook compared with the workbook written the way ctdpy does it: each template sheet is written with
+pandas.to_excel (ctdpy XlsxWriter.write_multiple_sheets) and sensor info is added afterwards by reopening the
+workbook (the previous SveaController flow).
+"""
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from svea import metadata_workbook
+from svea.metadata_workbook import MetadataWorkbook
+
+# Same layout as the ctdpy ctd_metadata template: (sheet_name, header_row)
+LAYOUT = [('Förklaring', None), ('Metadata', 2), ('Sensorinfo', 2), ('Information', None), ('Kolumnförklaring', 0)]
+
+SENSORINFO = {'B3': 'INSTRUMENT_SERIE', 'C3': 'PARAM', 'B4': '0745', 'C4': 'TEMP_CTD', 'H10': 'extra'}
+
+
+def get_template():
+    return {
+        'Förklaring': pd.DataFrame([['Format Profile', ''], ['', 'text']]),
+        'Metadata': pd.DataFrame({'MYEAR': ['2021', '2021'],
+                                  'SHIPC': ['77SE', '77SE'],
+                                  'SERNO': ['0001', '0002'],
+                                  'LATIT': ['5710.00', np.nan],
+                                  'WADEP': [31, 45]}),
+        'Sensorinfo': pd.DataFrame({'INSTRUMENT_SERIE': ['0745'], 'PARAM': ['TEMP_CTD'], 'COMNT': ['']}),
+        'Information': pd.DataFrame([['info']]),
+        'Kolumnförklaring': pd.DataFrame({'Kolumn': ['MYEAR', 'SHIPC'], 'Förklaring': ['År', 'Fartyg']}),
+    }
+
+
+def write_like_ctdpy(file_path, template, layout, sensorinfo):
+    """ ctdpy MetadataWriter._write followed by MetadataFile.add_sensorinfo_from_file """
+    with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
+        for sheet_name, header_row in layout:
+            template[sheet_name].to_excel(writer,
+                                          sheet_name=sheet_name,
+                                          header=header_row is not None,
+                                          startrow=header_row if header_row is not None else 0,
+                                          na_rep='',
+                                          index=False)
+    wb = openpyxl.load_workbook(file_path)
+    ws = wb['Sensorinfo']
+    for key, value in sensorinfo.items():
+        ws[key] = value
+    wb.save(file_path)
+
+
+def write_with_metadata_workbook(file_path, template, layout, sensorinfo):
+    workbook = MetadataWorkbook()
+    for sheet_name, header_row in layout:
+        workbook.add_sheet(sheet_name,
+                           df=template[sheet_name],
+                           header=header_row is not None,
+                           start_row=header_row if header_row is not None else 0)
+    workbook.add_cells('Sensorinfo', sensorinfo)
+    workbook.save(file_path)
+
+
+def get_cells(file_path):
+    """ {sheet_name: {coordinate: value}} for all non empty cells, sheets in workbook order """
+    wb = openpyxl.load_workbook(file_path)
+    cells = {}
+    for ws in wb.worksheets:
+        cells[ws.title] = {cell.coordinate: cell.value for row in ws.iter_rows() for cell in row
+                           if cell.value not in [None, '']}
+    return cells
+
+
+def assert_same_workbooks(path, expected_path):
+    cells = get_cells(path)
+    expected = get_cells(expected_path)
+    assert list(cells) == list(expected)
+    for sheet_name in expected:
+        assert cells[sheet_name] == expected[sheet_name], sheet_name
+
+
+def test_same_cells_as_ctdpy_writer(tmp_path):
+    expected_path = tmp_path / 'expected.xlsx'
+    path = tmp_path / 'metadata.xlsx'
+    write_like_ctdpy(expected_path, get_template(), LAYOUT, SENSORINFO)
+    write_with_metadata_workbook(path, get_template(), LAYOUT, SENSORINFO)
+    assert_same_workbooks(path, expected_path)
+
+
+def test_header_rows(tmp_path):
+    path = tmp_path / 'metadata.xlsx'
+    write_with_metadata_workbook(path, get_template(), LAYOUT, {})
+    wb = openpyxl.load_workbook(path)
+    assert wb['Metadata']['A3'].value == 'MYEAR'
+    assert wb['Metadata']['A1'].value is None
+    assert wb['Kolumnförklaring']['A1'].value == 'Kolumn'
+    assert wb['Förklaring']['A1'].value == 'Format Profile'
+
+
+def test_same_as_ctdpy_session_template(tmp_path):
+    ctdpy_session = pytest.importorskip('ctdpy.core.session')
+
+    session = ctdpy_session.Session()
+    writer = session.load_writer(metadata_workbook.WRITER)
+    writer.convert_formats()
+    writer.template_handler.template['Metadata'].sort(sort_by_keys=['SHIPC', 'SDATE', 'STIME'])
+    template = writer.template_handler.template
+    layout = [(sheet_name, start_row if header else None)
+              for sheet_name, header, start_row in metadata_workbook.get_sheet_layout(session)]
+
+    expected_path = tmp_path / 'expected.xlsx'
+    write_like_ctdpy(expected_path, template, layout, SENSORINFO)
+    path = tmp_path / metadata_workbook.get_file_name(session)
+    workbook = MetadataWorkbook()
+    workbook.add_from_ctdpy_session(session, {})
+    workbook.add_cells('Sensorinfo', SENSORINFO)
+    workbook.save(path)
+
+    assert path.name == 'ctd_metadata.xlsx'
+    assert_same_workbooks(path, expected_path)
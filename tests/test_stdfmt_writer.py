@@ -0,0 +1,70 @@
+"""
+svea.stdfmt_writer compared byte by byte with the way the ctdpy writer builds and writes the data lines
+(StandardCTDWriter._get_data_serie and numpy.savetxt(save_path, lines, fmt='%s')).
+"""
+import numpy as np
+import pandas as pd
+
+from svea import stdfmt_writer
+
+SEPARATOR = '\t'
+
+
+def get_data():
+    return pd.DataFrame({'PRES_CTD [dbar]': ['0.992', '1.985', '2.977'],
+                         'TEMP_CTD [deg C (ITS-90)]': ['10.4521', '10.4498', '10.3012'],
+                         'Q_TEMP_CTD': ['', 'B', ''],
+                         'STATN': ['Å17', 'Å17', 'Å17']})
+
+
+def write_like_ctdpy(df, save_path):
+    lines = [SEPARATOR.join(df.columns)]
+    lines.extend(df.apply(lambda x: SEPARATOR.join(x), axis=1).to_list())
+    np.savetxt(save_path, pd.Series(lines), fmt='%s')
+
+
+def write_fast(df, save_path):
+    stdfmt_writer.write_lines(stdfmt_writer.get_data_lines(df, separator=SEPARATOR), save_path)
+
+
+def test_same_bytes_as_ctdpy_writer(tmp_path):
+    expected_path = tmp_path / 'expected.txt'
+    path = tmp_path / 'fast.txt'
+    write_like_ctdpy(get_data(), expected_path)
+    write_fast(get_data(), path)
+    assert path.read_bytes() == expected_path.read_bytes()
+
+
+def test_many_lines(tmp_path):
+    df = pd.concat([get_data()] * 10000, ignore_index=True)
+    expected_path = tmp_path / 'expected.txt'
+    path = tmp_path / 'fast.txt'
+    write_like_ctdpy(df, expected_path)
+    stdfmt_writer.write_lines(stdfmt_writer.get_data_lines(df, separator=SEPARATOR), path, lines_per_block=7)
+    assert path.read_bytes() == expected_path.read_bytes()
+
+
+def test_numbers_and_missing_values(tmp_path):
+    df = get_data()
+    df['DEPH'] = [1, 2, 3]
+    df['COMNT'] = ['a', np.nan, 5]
+    lines = stdfmt_writer.get_data_lines(df, separator=SEPARATOR)
+    assert lines.iloc[1].split(SEPARATOR)[-2:] == ['1', 'a']
+    assert lines.iloc[2].split(SEPARATOR)[-2:] == ['2', '']
+    assert lines.iloc[3].split(SEPARATOR)[-2:] == ['3', '5']
+
+    # Same as the ctdpy writer after the missing values are filled and the values converted to text
+    expected_path = tmp_path / 'expected.txt'
+    path = tmp_path / 'fast.txt'
+    write_like_ctdpy(df.fillna('').astype(str), expected_path)
+    write_fast(df, path)
+    assert path.read_bytes() == expected_path.read_bytes()
+
+
+def test_text_data_as_written():
+    df = get_data()
+    df['DEPH'] = [1, 2, 3]
+    text_data = stdfmt_writer.get_text_data(df)
+    assert list(text_data.columns) == list(df.columns)
+    assert text_data['DEPH'].tolist() == ['1', '2', '3']
+    assert text_data['STATN'].tolist() == ['Å17', 'Å17', 'Å17']